@@ -1,6 +1,7 @@
 import configuration
 import nagios_notifier
 import proxyutil
+from utils import executor
 
 import sft_globals
 
@@ -31,3 +32,8 @@ def init_proxy_util(config):
         config -- configuration object
     """
     sft_globals.pxhandle = proxyutil.ProxyUtil(config)
+
+
+def init_executor():
+    """ initializes global executor of (arc) client commands. """
+    sft_globals.executor = executor.Executor()
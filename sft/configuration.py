@@ -33,6 +33,15 @@ class Config(object):
 
     OPTIONS = {'max_jobs_age': 2880,
             'refresh_period': 10,
+            'fetch_threads': 4,
+            'db_batch_size': 50,
+            'sft_refresh_interval': 30,
+            'downtime_provider': 'ndoutils',
+            'downtime_file': None,
+            'purge_chunk_size': 500,
+            'job_deadline': 1440,
+            'snapshot_gzip': 'false',
+            'reaper_rate': 10,
             'myproxy_server' : 'myproxy.smscg.ch',
             'myproxy_lifetime': 43200,
             'myproxy_port': 7512,
@@ -45,6 +54,14 @@ class Config(object):
             'nscaweb_queue': None, 
             'nscaweb_user': None,
             'nscaweb_pwd' : None,
+            'nscaweb_backend': 'http',
+            'nscaweb_batch_size': 50,
+            'nscaweb_timeout': 10,
+            'nscaweb_spool_dir': None,
+            'nscaweb_spool_max_segments': 50,
+            'notify_changes_only': 'false',
+            'notify_heartbeat': 3600,
+            'notify_max_messages': 10,
             'public_key' : None,
             'new_private_key' : None,
             'new_public_key' : None,
@@ -87,6 +104,59 @@ class Config(object):
             nscaweb_user. """ 
         return self.__get_option('nscaweb_pwd')
 
+    @property
+    def nscaweb_backend(self):
+        """ How notifications are sent to nscaweb host, either
+            'http' (persistent connection) or 'curl'. 
+        """
+        return self.__get_option('nscaweb_backend')
+
+    @property
+    def nscaweb_batch_size(self):
+        """ Max number of check results sent with one request. """
+        return int(self.__get_option('nscaweb_batch_size'))
+
+    @property
+    def nscaweb_timeout(self):
+        """ Timeout [secs] of requests to nscaweb host. """
+        return int(self.__get_option('nscaweb_timeout'))
+
+    @property
+    def nscaweb_spool_dir(self):
+        """ Directory where notifications are spooled until they've
+            been sent. If not set, notifications aren't spooled (and
+            get lost if they can't be sent).
+        """
+        return self.__get_option('nscaweb_spool_dir')
+
+    @property
+    def nscaweb_spool_max_segments(self):
+        """ Max number of spool segments (1000 notifications each), 
+            oldest segments get dropped if exceeded.
+        """
+        return int(self.__get_option('nscaweb_spool_max_segments'))
+
+    @property
+    def notify_changes_only(self):
+        """ Whether host/service pairs only get notified if their
+            status changed (or their heartbeat interval expired). 
+        """
+        return self.__get_option('notify_changes_only').lower() in ('1', 'true', 'yes', 'on')
+
+    @property
+    def notify_heartbeat(self):
+        """ Interval [secs] after which a host/service pair gets 
+            notified, even if its status did not change (see
+            notify_changes_only).
+        """
+        return int(self.__get_option('notify_heartbeat'))
+
+    @property
+    def notify_max_messages(self):
+        """ Max number of messages (most recent ones) sent per
+            host/service pair and notification. 
+        """
+        return int(self.__get_option('notify_max_messages'))
 
     @property
     def myproxy_server(self):
@@ -154,14 +224,79 @@ class Config(object):
         """
         return int(self.__get_option('max_jobs_age'))
 
+    @property
+    def job_deadline(self):
+        """ Default deadline [minutes] of SFT jobs. Jobs that did 
+            not complete within their deadline get status 'timeout'. 
+        """
+        return int(self.__get_option('job_deadline'))
+
+    @property
+    def snapshot_gzip(self):
+        """ Whether gzip compressed copies of the JSON snapshots
+            of the latest SFT results get written as well.
+        """
+        return self.__get_option('snapshot_gzip').lower() in ('1', 'true', 'yes', 'on')
+
+    @property
+    def purge_chunk_size(self):
+        """ Max number of old SFT jobs that get deleted 
+            from db within one transaction.
+        """
+        return int(self.__get_option('purge_chunk_size'))
+
+    @property
+    def reaper_rate(self):
+        """ Max number of output directories of old SFT jobs
+            that get removed per second.
+        """
+        return int(self.__get_option('reaper_rate'))
+
     @property
     def refresh_period(self):
-        """ Period for checking whether the SFT settings
-            have changed. Used to feed in changes 
-            that were e.g. entered via GridMonitor web-interface. 
+        """ Period [minutes] for cleaning up old SFT jobs and
+            for reloading all SFT settings (even if the configuration
+            version did not change, see sft_refresh_interval). 
         """
         return int(self.__get_option('refresh_period'))
 
+    @property
+    def sft_refresh_interval(self):
+        """ Interval [seconds] for checking whether SFTs have 
+            been modified (i.e. whether the version of the
+            SFT configuration has changed). 
+        """
+        return int(self.__get_option('sft_refresh_interval'))
+
+    @property
+    def downtime_provider(self):
+        """ Source of scheduled downtimes of clusters, either 
+            'ndoutils' (nagios db), 'file' (see downtime_file)
+            or 'none'.
+        """
+        return self.__get_option('downtime_provider')
+
+    @property
+    def downtime_file(self):
+        """ File listing scheduled downtimes (used by 
+            downtime_provider 'file').
+        """
+        return self.__get_option('downtime_file')
+
+    @property
+    def fetch_threads(self):
+        """ Maximal number of parallel downloads (arcget calls)
+            of finished SFT jobs.
+        """
+        return int(self.__get_option('fetch_threads'))
+
+    @property
+    def db_batch_size(self):
+        """ Maximal number of SFT jobs that get written to 
+            the db within one (bulk) insert and transaction.
+        """
+        return int(self.__get_option('db_batch_size'))
+
     @property
     def hostcert(self):
         """ Host certificate. """
@@ -374,7 +509,7 @@ class Config(object):
 
         
         Config.DB_SFT_OPTIONS['sqlalchemy_sft.url'] = cfgs['sqlalchemy_sft.url']
-        Config.DB_NAGIOS_OPTIONS['sqlalchemy_nagios.url'] = cfgs['sqlalchemy_nagios.url']
+        Config.DB_NAGIOS_OPTIONS['sqlalchemy_nagios.url'] = cfgs.get('sqlalchemy_nagios.url')
 
         self.log.debug("Configuration successfully checked")
 
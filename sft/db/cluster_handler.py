@@ -5,7 +5,7 @@ Dealing with cluster and cluster groups
 import logging
 import sft_meta
 import sft_schema as schema
-from sft.utils.helpers import strip_args
+from sft.utils.helpers import strip_args, bump_config_version
 
 class ClusterPool():
     """ This class is used to define a 'global' set of 
@@ -38,6 +38,7 @@ class ClusterPool():
             self.log.info("Adding cluster '%s'." % hostname)
             cluster = schema.Cluster(hostname,alias)
             self.session.add(cluster)
+        bump_config_version(self.session)
         self.session.commit() 
 
     @strip_args
@@ -49,6 +50,7 @@ class ClusterPool():
         if cluster:
             self.log.info("Removing cluster '%s'." % hostname)
             self.session.delete(cluster)   
+            bump_config_version(self.session)
             self.session.commit()
 
     def list_clusters(self):
@@ -80,6 +82,7 @@ class ClusterGroupPool():
         else:
             self.log.info("Adding group '%s'." % groupname)
             self.session.add(schema.ClusterGroup(groupname))
+            bump_config_version(self.session)
             self.session.commit()
 
     @strip_args
@@ -90,6 +93,7 @@ class ClusterGroupPool():
         if group:
             self.log.info("Removing group '%s'." % groupname)
             self.session.delete(group)
+            bump_config_version(self.session)
             self.session.commit()
 
              
@@ -114,6 +118,7 @@ class ClusterGroupPool():
         if not cluster in group.clusters:
             self.log.info("Cluster '%s' added to group '%s'." % (clustername, groupname))
             group.clusters.append(cluster) 
+        bump_config_version(self.session)
         self.session.commit()
     
     @strip_args 
@@ -128,6 +133,7 @@ class ClusterGroupPool():
         if group and cluster in group.clusters:
             group.clusters.remove(cluster)
             self.log.debug("Removing cluster '%s' from group '%s'." % (clustername, groupname))
+            bump_config_version(self.session)
             self.session.commit()
 
     @strip_args
@@ -5,7 +5,7 @@ Dealing with SFT tests.
 import logging
 import sft_meta
 import sft_schema as schema
-from sft.utils.helpers import strip_args
+from sft.utils.helpers import strip_args, bump_config_version
 
 class SFTPool():
     """ This class defines all site functional tests (SFT)s 
@@ -44,6 +44,7 @@ class SFTPool():
         sft.vo_group = vo_grp
         sft.test_suit = test_suit
         self.session.add(sft)
+        bump_config_version(self.session)
         self.session.commit() 
 
     @strip_args
@@ -55,8 +56,9 @@ class SFTPool():
                     hour    - hour  0-23, default * 
                     day     - day   1-31, default *
                     month   - month 1-12, default * 
-                    weekday - day of week 0-6, Sunday=0, default * 
-            Notice: for each param, you can use crontab notation, e.g. '*', '1-3', '*/5', etc.
+                    weekday - day of week 0-6, Monday=0, default * 
+            Notice: for each param, you can use crontab notation, e.g. '*', '1-3', '*/5', 
+                    'mon-fri', etc. (see sft.utils.cron). Times are in UTC.
         """
         sft = self.session.query(schema.SFTTest).filter_by(name=name).first()
         if sft:
@@ -64,9 +66,26 @@ class SFTPool():
             sft.hour = hour
             sft.day = day
             sft.month= month
-            sft.weekday = weekday
+            sft.day_of_week = weekday
+            bump_config_version(self.session)
             self.session.commit()
         
+    @strip_args
+    def set_job_deadline(self, name, minutes=None):
+        """ Setting deadline of the jobs of the SFT. Jobs that did not
+            complete within their deadline get status 'timeout'.
+            params: name - name of the SFT
+                    minutes - deadline in minutes after submission, default
+                              None, i.e. 'job_deadline' of the configuration 
+        """
+        sft = self.session.query(schema.SFTTest).filter_by(name=name).first()
+        if sft:
+            if minutes:
+                minutes = int(minutes)
+            sft.job_deadline = minutes or None
+            bump_config_version(self.session)
+            self.session.commit()
+
     @strip_args
     def remove_sft(self, name):
         """ removing SFT from SFT pool.
@@ -76,6 +95,7 @@ class SFTPool():
         if sft:
             self.log.info("Removing sft '%s'." % name)
             self.session.delete(sft)   
+            bump_config_version(self.session)
             self.session.commit()
 
     def list_sfts(self):
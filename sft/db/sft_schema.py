@@ -71,7 +71,8 @@ t_sft_test = sa.Table("sft_test", sft_meta.metadata,
         sa.Column("hour", sa.types.VARCHAR(32, convert_unicode=True), default='*'),
         sa.Column("day", sa.types.VARCHAR(32, convert_unicode=True), default='*'),
         sa.Column("month", sa.types.VARCHAR(32, convert_unicode=True), default='*'),
-        sa.Column("day_of_week", sa.types.VARCHAR(32, convert_unicode=True), default='*'))
+        sa.Column("day_of_week", sa.types.VARCHAR(32, convert_unicode=True), default='*'),
+        sa.Column("job_deadline", sa.types.Integer, default=None)) # minutes, None -> config
 
 
 t_sft_job = sa.Table("sft_job", sft_meta.metadata,
@@ -87,9 +88,120 @@ t_sft_job = sa.Table("sft_job", sft_meta.metadata,
         sa.Column('outputdir',sa.types.VARCHAR(256, convert_unicode=True)),
         sa.Column('status', sa.types.VARCHAR(64, convert_unicode=True), default=None),
         sa.Column("submissiontime",sa.types.DateTime, default=datetime.utcnow),
+        sa.Column("db_lastmodified",sa.types.DateTime, default=datetime.utcnow),
+        sa.Column('is_active', sa.types.Boolean, nullable=False, default=True),
+        sa.Column("next_check_time", sa.types.DateTime, default=None),
+        sa.Column('joblist', sa.types.VARCHAR(256, convert_unicode=True), default=None) # arc job list of job
+)
+
+# access paths of the daemon (polling of active jobs, clean up of old jobs) 
+# and of the GridMonitor (latest jobs of SFTs and clusters)
+sa.Index('ix_sft_job_active', t_sft_job.c.is_active, t_sft_job.c.status)
+sa.Index('ix_sft_job_next_check', t_sft_job.c.is_active, t_sft_job.c.next_check_time)
+sa.Index('ix_sft_job_lastmodified', t_sft_job.c.db_lastmodified)
+sa.Index('ix_sft_job_cluster', t_sft_job.c.cluster_name, t_sft_job.c.submissiontime)
+sa.Index('ix_sft_job_sft_cluster', t_sft_job.c.sft_test_name, 
+        t_sft_job.c.cluster_name, t_sft_job.c.submissiontime)
+
+# latest job (result) per SFT, cluster, VO and test. Maintained by the 
+# SFT daemon whenever a job is submitted or changes its state 
+# (see helpers.update_latest_results)
+t_latest_result = sa.Table("sft_latest_result", sft_meta.metadata,
+        sa.Column('sft_test_name', sa.types.VARCHAR(64, convert_unicode=True), primary_key=True),
+        sa.Column('cluster_name', sa.types.VARCHAR(256, convert_unicode=True), primary_key=True),
+        sa.Column('vo_name', sa.types.VARCHAR(64, convert_unicode=True), primary_key=True),
+        sa.Column('test_name', sa.types.VARCHAR(64, convert_unicode=True), primary_key=True),
+        sa.Column('DN', sa.types.VARCHAR(256, convert_unicode=True)),
+        sa.Column('jobid', sa.types.VARCHAR(256, convert_unicode=True)),
+        sa.Column('error_type', sa.types.VARCHAR(64, convert_unicode=True), default=None),
+        sa.Column('error_msg', sa.types.Text()),
+        sa.Column('outputdir',sa.types.VARCHAR(256, convert_unicode=True)),
+        sa.Column('status', sa.types.VARCHAR(64, convert_unicode=True), default=None),
+        sa.Column("submissiontime",sa.types.DateTime, default=datetime.utcnow),
         sa.Column("db_lastmodified",sa.types.DateTime, default=datetime.utcnow)
 )
 
+sa.Index('ix_sft_latest_result_cluster', t_latest_result.c.cluster_name)
+
+# columns of t_latest_result that are copied from the jobs 
+LATEST_RESULT_COLUMNS = [c.name for c in t_latest_result.columns]
+
+# append-only log of the state transitions of SFT jobs. The (increasing) 
+# sequence number allows consumers to read the log incrementally, with
+# a re-scan of the recent transitions, as they don't become visible in
+# sequence order (see helpers.log_job_transitions and 
+# helpers.get_job_transitions)
+t_job_transition = sa.Table("sft_job_transition", sft_meta.metadata,
+        sa.Column('seq', sa.types.Integer, primary_key=True, autoincrement=True),
+        sa.Column('job_id', sa.types.Integer, default=None), # None for new jobs
+        sa.Column('jobid', sa.types.VARCHAR(256, convert_unicode=True)),
+        sa.Column('sft_test_name', sa.types.VARCHAR(64, convert_unicode=True)),
+        sa.Column('cluster_name', sa.types.VARCHAR(256, convert_unicode=True)),
+        sa.Column('vo_name', sa.types.VARCHAR(64, convert_unicode=True)),
+        sa.Column('test_name', sa.types.VARCHAR(64, convert_unicode=True)),
+        sa.Column('status', sa.types.VARCHAR(64, convert_unicode=True)),
+        sa.Column("time", sa.types.DateTime, default=datetime.utcnow)
+)
+
+sa.Index('ix_sft_job_transition_time', t_job_transition.c.time)
+
+# states in which an SFT job is done with, i.e. there is nothing 
+# left to be queried or fetched. Notice, 'FAILED' (ARC state, job can 
+# still be fetched) differs from 'failed' (submission failed).
+FINAL_JOB_STATES = frozenset(['failed', 'fetched', 'success', 'fetched_failed', 
+        'fetch_failed', 'test_failed', 'timeout', 'KILLED', 'DELETED'])
+
+# states of jobs that finished on the cluster and are ready to be fetched 
+FETCHABLE_JOB_STATES = ('FAILED', 'FINISHED')
+
+def is_active_status(status):
+    """ returns True if job with given status has not yet reached 
+        a final state.
+    """
+    return status not in FINAL_JOB_STATES
+
+# single row (id=1) table, holding a counter that gets bumped on every
+# change of the SFT configuration (see helpers.bump_config_version)
+t_config_version = sa.Table("sft_config_version", sft_meta.metadata,
+        sa.Column('id', sa.types.Integer, primary_key=True, autoincrement=False),
+        sa.Column('version', sa.types.Integer, nullable=False, default=0))
+
+def decrypt_passwd(passwd):
+    """ returns plaintext of (encrypted) user password passwd. """
+    privkey = g.config.private_key
+    new_privkey = g.config.new_private_key
+    if new_privkey:
+        try:
+            rc = rsa.RSACipher(privkey)
+            plain_passwd = rc.private_decrypt(passwd) 
+        except:
+            rc = rsa.RSACipher(new_privkey) # we do not catch exception here
+            plain_passwd = rc.private_decrypt(passwd) 
+    else:
+        rc = rsa.RSACipher(privkey)
+        plain_passwd = rc.private_decrypt(passwd) 
+    
+    return plain_passwd
+
+
+class LatestResult(object):
+    """ Latest job of an SFT for a given cluster, VO and test. Has the
+        same attributes as SFTJob (except for its id and is_active).
+    """
+    pass
+
+class JobTransition(object):
+    """ State transition of an SFT job. The status 'purged' denotes 
+        the removal of the job from the db.
+    """
+    pass
+
+class ConfigVersion(object):
+    """ Version of the SFT configuration. Gets bumped on every 
+        change of the SFTs, their groups, and group members. 
+    """
+    pass
+
 class Cluster(object):
     def __init__(self,hostname, alias=None):
         self.hostname = hostname
@@ -138,20 +250,7 @@ class User(object):
             self.passwd = rc.priv_public_encrypt(pwd)
         
     def get_passwd(self):
-        privkey = g.config.private_key
-        new_privkey = g.config.new_private_key
-        if new_privkey:
-            try:
-                rc = rsa.RSACipher(privkey)
-                plain_passwd = rc.private_decrypt(self.passwd) 
-            except:
-                rc = rsa.RSACipher(new_privkey) # we do not catch exception here
-                plain_passwd = rc.private_decrypt(self.passwd) 
-        else:
-            rc = rsa.RSACipher(privkey)
-            plain_passwd = rc.private_decrypt(self.passwd) 
-        
-        return plain_passwd
+        return decrypt_passwd(self.passwd)
                     
 class VOUsers(object):
     pass
@@ -175,6 +274,12 @@ class SFTJob(object):
         self.sft_test_name = sft_test_name
         self.error_type = error_type
         self.error_msg = error_msg
+        self.is_active = True
+
+    def set_status(self, status):
+        """ sets status of job, and whether job is still active """
+        self.status = status
+        self.is_active = is_active_status(status)
 
 
 mapper(Cluster, t_cluster)
@@ -208,8 +313,20 @@ mapper(TestSuit, t_test_suit,
     secondary=t_test_suit_as, backref='suits'))
 )
 
-# 1:1 mappings 
-mapper(SFTTest, t_sft_test)
+# N:1 relations between SFT and its groups. The relation properties
+# allow to (eagerly) load an SFT with all its groups at once.
+mapper(SFTTest, t_sft_test,
+    properties=dict(
+    vo_group_details=relationship(VOGroup),
+    cluster_group_details=relationship(ClusterGroup),
+    test_suit_details=relationship(TestSuit))
+)
 
 mapper(SFTJob, t_sft_job)
 
+mapper(ConfigVersion, t_config_version)
+
+mapper(LatestResult, t_latest_result)
+
+mapper(JobTransition, t_job_transition)
+
@@ -5,7 +5,7 @@ Dealing with test and test suits
 import logging
 import sft_meta
 import sft_schema as schema
-from sft.utils.helpers import strip_args
+from sft.utils.helpers import strip_args, bump_config_version
 
 class TestPool():
     """ The test pool class is used to define a global set 
@@ -34,6 +34,7 @@ class TestPool():
             test = schema.Test(name,xrsl)
 
         self.session.add(test)
+        bump_config_version(self.session)
         self.session.commit() 
 
     @strip_args
@@ -45,6 +46,7 @@ class TestPool():
         if test:
             self.log.info("Removing test '%s'." % name)
             self.session.delete(test)   
+            bump_config_version(self.session)
             self.session.commit()
 
     def list_tests(self):
@@ -77,6 +79,7 @@ class TestSuitPool():
         else:
             self.session.add(schema.TestSuit(suitname))
             self.log.info("Created test suit '%s'" % suitname)
+            bump_config_version(self.session)
             self.session.commit()
 
 
@@ -89,6 +92,7 @@ class TestSuitPool():
         if suit:
             self.log.info("Removing suit '%s'." % suitname)
             self.session.delete(suit)
+            bump_config_version(self.session)
             self.session.commit()
              
 
@@ -115,6 +119,8 @@ class TestSuitPool():
             self.log.info("Added test '%s' to test suit '%s'" % (testname, suitname))
             suit.tests.append(test) 
         
+        bump_config_version(self.session)
+        
         self.session.commit()
     
     @strip_args
@@ -128,6 +134,7 @@ class TestSuitPool():
         if suit and test in suit.tests:
             self.log.debug("Removing test %s from suit '%s'." % (testname, suitname))
             suit.tests.remove(test)
+            bump_config_version(self.session)
             self.session.commit()
         
     def list_testsuits(self):
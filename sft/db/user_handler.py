@@ -5,7 +5,7 @@ Dealing with cluster and cluster groups
 import logging
 import sft_meta
 import sft_schema as schema
-from sft.utils.helpers import strip_args
+from sft.utils.helpers import strip_args, bump_config_version
 
 class UserPool():
     """ Creates a 'global' pool of users, which can be 
@@ -38,6 +38,7 @@ class UserPool():
             self.log.info("Adding user '%s'." % DN)
             user = schema.User(DN, display_name, pwd)
             self.session.add(user)
+        bump_config_version(self.session)
         self.session.commit() 
 
     @strip_args
@@ -66,6 +67,7 @@ class UserPool():
         user = self.session.query(schema.User).filter_by(DN=DN).first()
         if user:
             user.reset_passwd(pwd)
+            bump_config_version(self.session)
             self.session.commit()
 
     @strip_args
@@ -77,6 +79,7 @@ class UserPool():
         if user:
             self.log.info("Removing user '%s'." % DN)
             self.session.delete(user)   
+            bump_config_version(self.session)
             self.session.commit()
     
     def list_users(self):
@@ -5,7 +5,7 @@ Dealing with VOs and VO groups
 import logging
 import sft_meta
 import sft_schema as schema
-from sft.utils.helpers import strip_args
+from sft.utils.helpers import strip_args, bump_config_version
 
 class VOPool():
     """ Pool of VOs that can be used to create VO groups (see VOUserPool),
@@ -33,6 +33,7 @@ class VOPool():
             self.log.info("Adding vo '%s'." % name)
             vo = schema.VO(name, server)
             self.session.add(vo)
+        bump_config_version(self.session)
         self.session.commit() 
 
     @strip_args
@@ -44,6 +45,7 @@ class VOPool():
         if vo:
             self.log.info("Removing vo '%s'." % name)
             self.session.delete(vo)   
+            bump_config_version(self.session)
             self.session.commit()
 
     def list_vos(self): 
@@ -74,6 +76,7 @@ class VOGroupPool():
         else:
             self.session.add(schema.VOGroup(groupname))
             self.log.info("Created VO group '%s'." % groupname)
+            bump_config_version(self.session)
             self.session.commit()
     
     @strip_args
@@ -86,6 +89,7 @@ class VOGroupPool():
         if group:
             self.log.info("Removing group '%s'." % groupname)
             self.session.delete(group)
+            bump_config_version(self.session)
             self.session.commit()
     
     @strip_args
@@ -110,6 +114,8 @@ class VOGroupPool():
         if not vo in group.vos:
             group.vos.append(vo) 
         
+        bump_config_version(self.session)
+        
         self.session.commit()
     
     @strip_args 
@@ -124,6 +130,7 @@ class VOGroupPool():
         if group and vo in group.vos:
             group.vos.remove(vo)
             self.log.debug("Removed VO '%s' from VO group '%s'." % (voname, groupname))
+            bump_config_version(self.session)
             self.session.commit()
 
     @strip_args
@@ -173,6 +180,7 @@ class VOUserPool():
         
         if not vo in user.vos:
             user.vos.append(vo) 
+            bump_config_version(self.session)
             self.session.commit()
 
     @strip_args
@@ -188,6 +196,7 @@ class VOUserPool():
         if vo and user in vo.users:
             vo.users.remove(user)
             self.log.debug("User '%s' removed from VO '%s'." % (DN, voname))
+            bump_config_version(self.session)
             self.session.commit()
     
     @strip_args
@@ -0,0 +1,228 @@
+"""
+Providers of scheduled downtimes of clusters.
+
+The providers cache the downtime intervals (incl. upcoming ones),
+hence the set of clusters that are currently down can be derived
+without touching the backend. The backend is only queried again
+if the cached intervals may be outdated, i.e. if an interval
+started or ended or a new interval got scheduled.
+
+Available providers:
+    . ndoutils - downtimes of the Nagios ndoutils database (default)
+    . file - downtimes listed in a plain text file
+    . none - no downtimes at all
+"""
+__author__ = "Placi Flury grid@switch.ch"
+__date__ = "18.10.2026"
+__version__ = "0.1.0"
+
+import os
+import os.path
+import logging
+from datetime import datetime
+from sqlalchemy import func
+
+from sft.errors.config import ConfigError
+
+
+class DowntimeProvider(object):
+    """ Base class of downtime providers, without any downtimes. 
+        Subclasses implement _load_intervals() and may implement
+        _changed(), which tells whether the backend must be
+        queried again.
+
+        Notice, times are local times, as used by nagios.
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self.intervals = None   # list of (hostname, start, end) tupples
+        self.down = frozenset()
+        self.next_boundary = None # time the set of down clusters changes next
+
+    def _load_intervals(self, now):
+        """ returns list of (hostname, start, end) tupples of all
+            downtimes that haven't ended at time 'now'.
+        """
+        return []
+
+    def _changed(self, now):
+        """ returns True if intervals must be reloaded, e.g. as
+            a new downtime got scheduled.
+        """
+        return False
+
+    def __update_down(self, now):
+        """ computes set of clusters that are down at time 'now'
+            out of the cached intervals.
+        """
+        down = set()
+        boundaries = []
+        for host, start, end in self.intervals:
+            if end < now:
+                continue
+            if start <= now:
+                down.add(host)
+                boundaries.append(end)
+            else:
+                boundaries.append(start)
+
+        self.down = frozenset(down)
+        if boundaries:
+            self.next_boundary = min(boundaries)
+        else:
+            self.next_boundary = None
+
+    def refresh(self, now = None):
+        """ updates set of clusters that are on scheduled downtime.
+            The backend only gets queried if the cached downtime
+            intervals are outdated.
+
+            now - local time, defaults to current time.
+            returns set (frozenset) of clusters that are down
+        """
+        if not now:
+            now = datetime.now() # not UTC as nagios is using local time
+
+        old_down = self.down
+        if self.intervals is None or self._changed(now):
+            self.intervals = self._load_intervals(now)
+            self.__update_down(now)
+            self.log.debug("Loaded %d downtime intervals." % len(self.intervals))
+        elif self.next_boundary and self.next_boundary < now:
+            self.__update_down(now)
+
+        if self.down != old_down:
+            self.log.info("Hosts currently scheduled down: %r" % sorted(self.down))
+        return self.down
+
+    @property
+    def down_clusters(self):
+        """ returns set (frozenset) of clusters that have
+            been down at last refresh.
+        """
+        return self.down
+
+
+class NoDowntimeProvider(DowntimeProvider):
+    """ Clusters never go on scheduled downtime. """
+    pass
+
+
+class NDOUtilsDowntimeProvider(DowntimeProvider):
+    """ Downtimes as stored by nagios in the ndoutils database.
+        Only downtimes that haven't ended are fetched. A cheap
+        aggregate over the same rows tells whether the
+        downtimes have been changed since last load. Besides 
+        the number and bounds of the downtimes, it covers their 
+        latest entry time and their hosts (sum of object ids), so 
+        downtimes that got replaced or moved to another host 
+        are noticed as well.
+    """
+
+    def __init__(self):
+        DowntimeProvider.__init__(self)
+        # imported only here, so other providers don't need gridmonitor
+        from gridmonitor.model.nagios import meta as nagios_meta
+        from gridmonitor.model.nagios import scheduleddowntimes
+        self.nagios_meta = nagios_meta
+        self.model = scheduleddowntimes.ScheduledDownTime
+        self.signature = None
+
+    def __query_signature(self, now):
+        """ returns signature of the downtimes that haven't ended """
+        session = self.nagios_meta.Session()
+        signature = tuple(session.query(func.count(),
+                func.min(self.model.scheduled_start_time),
+                func.max(self.model.scheduled_start_time),
+                func.max(self.model.scheduled_end_time),
+                func.max(self.model.entry_time),
+                func.sum(self.model.object_id)).\
+                filter(self.model.scheduled_end_time >= now).one())
+        session.commit() # end transaction, to see later changes
+        return signature
+
+    def _changed(self, now):
+        return self.__query_signature(now) != self.signature
+
+    def _load_intervals(self, now):
+        self.signature = self.__query_signature(now)
+        session = self.nagios_meta.Session()
+        intervals = []
+        for sched_item in session.query(self.model).\
+                filter(self.model.scheduled_end_time >= now).all():
+            intervals.append((sched_item.generic_object.name1,
+                sched_item.scheduled_start_time,
+                sched_item.scheduled_end_time))
+        session.commit() # end transaction, to see later changes
+        return intervals
+
+
+class FileDowntimeProvider(DowntimeProvider):
+    """ Downtimes listed in a plain text file, one downtime per line:
+
+            <hostname> <start> <end>
+
+        with start and end as local time in format 'YYYY-mm-ddTHH:MM'.
+        Empty lines and lines starting with '#' are ignored. The file
+        gets reloaded if its modification time changes.
+    """
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M'
+
+    def __init__(self, path):
+        DowntimeProvider.__init__(self)
+        self.path = path
+        self.mtime = None
+
+    def __get_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _changed(self, now):
+        return self.__get_mtime() != self.mtime
+
+    def _load_intervals(self, now):
+        self.mtime = self.__get_mtime()
+        intervals = []
+        if self.mtime is None:
+            self.log.warn("Downtime file '%s' does not exist." % self.path)
+            return intervals
+
+        for lnr, line in enumerate(open(self.path, 'r')):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                host, start, end = line.split()
+                start = datetime.strptime(start, FileDowntimeProvider.TIME_FORMAT)
+                end = datetime.strptime(end, FileDowntimeProvider.TIME_FORMAT)
+            except ValueError:
+                self.log.error("Invalid downtime in '%s' (line %d): '%s'" % \
+                    (self.path, lnr + 1, line))
+                continue
+            if end >= now:
+                intervals.append((host, start, end))
+        return intervals
+
+
+def get_provider(config):
+    """ returns downtime provider as set in configuration
+
+        config - configuration object
+        raises ConfigError for unknown providers
+    """
+    name = config.downtime_provider
+    if name == 'ndoutils':
+        return NDOUtilsDowntimeProvider()
+    if name == 'file':
+        if not config.downtime_file:
+            raise ConfigError('Missing Parameter',
+                "Downtime provider 'file' requires parameter 'downtime_file'.")
+        return FileDowntimeProvider(config.downtime_file)
+    if name == 'none':
+        return NoDowntimeProvider()
+    raise ConfigError('Invalid Parameter',
+        "Unknown downtime provider '%s'." % name)
@@ -11,6 +11,9 @@ class CronError(Exception):
         self.expression = expression
         self.msg = message
 
+    def __str__(self):
+        return self.msg
+
 class CronRangeError(CronError):
     """ Raised if the specified time is 
         exceeding a max range.
@@ -7,11 +7,10 @@ Housekeeping module with the following chores:
 """
 import logging
 import time
-import shutil
+import hashlib
 from datetime import datetime
 
-from gridmonitor.model.nagios import meta as nagios_meta
-from gridmonitor.model.nagios import scheduleddowntimes
+import sqlalchemy as sa
 
 import sft.db.sft_meta as meta
 import sft.db.sft_schema as schema
@@ -20,91 +19,181 @@ from sft.utils import helpers
 from sft.nagios_notifier import NagiosNotification
 import sft.sft_globals as g
 from sft.sft_event import SFT_Event
+from sft import downtime
+from sft.reaper import DirectoryReaper
 
 class Housekeeper(object):
     
+    MAX_PURGE_CHUNKS = 20 # max chunks of old jobs deleted per call of __clean_jobs
     
     def __init__(self):
         self.log = logging.getLogger(__name__)
         self.sft_list = []
-        self.down_clusters = []
-        self.sft_refresh_cnt = g.config.refresh_period # refreshing SFT period 
-                            # using (same counter for cleaning up old jobs)
-        self.log.info("Refresh counter for SFTs set to '%d' minutes " % self.sft_refresh_cnt)
+        self.sft_events = {}    # SFT name -> (fingerprint, SFT_Event or None)
+        self.config_version = None # version of SFT configuration of last refresh
+        self.downtimes = downtime.get_provider(g.config)
+        self.reaper = DirectoryReaper(g.config.reaper_rate)
+        self.sft_generation = 0 # bumped whenever the list of SFTs changes
+        self.clean_cnt = g.config.refresh_period # period for cleaning up old jobs
+        self.log.info("Refresh counter for cleaning jobs set to '%d' minutes " % self.clean_cnt)
         self.__refresh_down_clusters()
-        self.__refresh_SFTs()
+        self.refresh_sfts(force = True)
     
     def __refresh_down_clusters(self):
-        """ refreshes list of clusters with scheduled downtime. """
+        """ refreshes set of clusters with scheduled downtime. """
+        try:
+            self.downtimes.refresh()
+        except Exception, e:
+            self.log.error("Refreshing scheduled downtimes failed: %r" % e)
 
-        self.down_clusters = []
-        now = datetime.now() # not UTC as nagios is using local time
-
-        for sched_item in nagios_meta.Session().\
-                query(scheduleddowntimes.ScheduledDownTime).all():
-            if sched_item.scheduled_start_time > now:
-                continue
-            if sched_item.scheduled_end_time < now:
-                continue
-            _host = sched_item.generic_object.name1
-            if _host not in self.down_clusters:
-                self.down_clusters.append(_host)
-
-        self.log.info("Hosts currently scheduled down: %r" % self.down_clusters)
-
-    def __refresh_SFTs(self):
+    def __fingerprint(self, sft):
+        """ 
+            returns fingerprint of SFT test description object, 
+            covering its execution times and its groups (incl. 
+            their members).
+        """
+        vos = clusters = tests = None
+        if sft.vo_group_details:
+            vos = sorted([(vo.name, sorted([(u.DN, u.passwd) for u in vo.users]))
+                    for vo in sft.vo_group_details.vos])
+        if sft.cluster_group_details:
+            clusters = sorted([c.hostname for c in sft.cluster_group_details.clusters])
+        if sft.test_suit_details:
+            tests = sorted([(t.name, t.xrsl) for t in sft.test_suit_details.tests])
+
+        return hashlib.md5(repr((sft.minute, sft.hour, sft.day, sft.month, 
+                sft.day_of_week, sft.vo_group, vos, sft.cluster_group, 
+                clusters, sft.test_suit, tests))).hexdigest()
+
+    def refresh_sfts(self, force = False):
         """
             refreshes list of SFTs and the 
             internals of the SFTs (e.g. like 
             changed execution times etc.)
+            Only SFTs whose fingerprint changed, or which could not 
+            be built at last refresh, get rebuilt. SFTs that no 
+            longer exist are dropped.
+
+            force - if False, SFTs are only reloaded if the version of 
+                    the SFT configuration has changed since last refresh,
+                    or if there are SFTs to be rebuilt.
         """
-        self.sft_list = list()
+        version = helpers.get_config_version()
+        failed = [name for name, (_, _event) in self.sft_events.items() if not _event]
+        if not force and not failed and version == self.config_version:
+            meta.Session.commit() # end transaction, to see later changes
+            return
+        self.config_version = version
+
+        _events = {}
+        changed = False
         
-        for sft in helpers.get_sft_tests_details():
+        for sft in helpers.get_sft_tests_snapshot():
+            fingerprint = self.__fingerprint(sft)
+            if self.sft_events.has_key(sft.name) and \
+                    self.sft_events[sft.name][0] == fingerprint and \
+                    self.sft_events[sft.name][1]:
+                _events[sft.name] = self.sft_events[sft.name]
+                continue
+
             self.log.debug("Refreshing SFT '%s' from db" % sft.name)
+            if not self.sft_events.has_key(sft.name) or \
+                    self.sft_events[sft.name][0] != fingerprint:
+                changed = True
             try: 
-                _minute = helpers.parse_cron_entry(sft.minute, 59)
-                _hour = helpers.parse_cron_entry(sft.hour, 23)
-                _day = helpers.parse_cron_entry(sft.day, 31)
-                _month = helpers.parse_cron_entry(sft.month, 12)
-                _dow = helpers.parse_cron_entry(sft.day_of_week, 6)
-
                 event = SFT_Event(sft.name,
-                        minute = _minute, hour = _hour,
-                        day = _day, month = _month,
-                        dow = _dow)
+                        minute = sft.minute, hour = sft.hour,
+                        day = sft.day, month = sft.month,
+                        dow = sft.day_of_week,
+                        sft = sft)
             except Exception, ex:
                 _notification = NagiosNotification(g.config.localhost, sft.name)
                 _notification.set_message(str(ex)) # due to depreciation warning
                 _notification.set_status('CRITICAL')
                 g.notifier.add_notification(_notification)
-                continue 
+                event = None  # retried at next refresh
+
+            if event:
+                changed = True
+            _events[sft.name] = (fingerprint, event)
 
-            self.sft_list.append(event)    
+        for name in self.sft_events.keys():
+            if not _events.has_key(name):
+                self.log.info("SFT '%s' got removed." % name)
+                changed = True
+
+        # end transaction, so the next refresh sees changes of others
+        meta.Session.commit()
+
+        self.sft_events = _events
+        if changed:
+            self.sft_list = [_event for _, _event in _events.values() if _event]
+            self.sft_generation += 1
 
 
     def __clean_jobs(self):
         """ 
-        removes old SFT jobs.   
+        removes old SFT jobs. Jobs get deleted in chunks of 
+        'purge_chunk_size' jobs, each in its own transaction. 
+        Their output directories are removed by the reaper thread. 
+        Latest results of old jobs, or of SFTs or clusters that no 
+        longer exist, are removed as well.
+
+        returns True if all old jobs have been removed, False 
+        if there are jobs left (MAX_PURGE_CHUNKS reached).
         """ 
         session = meta.Session
+        t_job = schema.t_sft_job
         fetched_before = datetime.utcfromtimestamp(time.time() - (g.config.max_jobs_age * 60))
-
-        fjobs = session.query(schema.SFTJob).filter(schema.SFTJob.db_lastmodified<=fetched_before).all()
-
-        self.log.info("Xfetched jobs")
-        if fjobs:
-            self.log.info("Removing %d jobs from db that got fetched." % len(fjobs))
-            for j in fjobs:
-                if j.outputdir:
-                    jobdir = g.config.url_root + j.outputdir
-                    self.log.info("Removing job directory at '%s'" % jobdir)
-                    try:
-                        shutil.rmtree(jobdir)
-                    except:
-                        pass
-                session.delete(j)
+        chunk_size = g.config.purge_chunk_size
+        removed = 0
+
+        try:
+            for _ in xrange(Housekeeper.MAX_PURGE_CHUNKS):
+                rows = [dict(row) for row in session.execute(sa.select([t_job.c.id, 
+                        t_job.c.jobid, t_job.c.sft_test_name, t_job.c.cluster_name, 
+                        t_job.c.vo_name, t_job.c.test_name, t_job.c.outputdir]).\
+                        where(t_job.c.db_lastmodified <= fetched_before).\
+                        order_by(t_job.c.id).limit(chunk_size)).fetchall()]
+                if not rows:
+                    break
+                session.execute(t_job.delete().\
+                        where(t_job.c.id.in_([row['id'] for row in rows])))
+                helpers.log_job_transitions(session, rows, status = 'purged')
+                session.commit()
+                removed += len(rows)
+
+                for row in rows:
+                    if row['outputdir']:
+                        self.reaper.add(g.config.url_root + row['outputdir'])
+                if len(rows) < chunk_size:
+                    break
+            else:
+                self.log.info("Removed %d old jobs from db, more to come." % removed)
+                return False
+
+            # transitions are kept as long as the jobs
+            t_transition = schema.t_job_transition
+            session.execute(t_transition.delete().\
+                    where(t_transition.c.time <= fetched_before))
+
+            # latest results of purged jobs, or of removed SFTs and clusters
+            t_latest = schema.t_latest_result
+            session.execute(t_latest.delete().where(sa.or_(
+                    t_latest.c.db_lastmodified <= fetched_before,
+                    ~t_latest.c.sft_test_name.in_(
+                        sa.select([schema.t_sft_test.c.name])),
+                    ~t_latest.c.cluster_name.in_(
+                        sa.select([schema.t_cluster.c.hostname])))))
             session.commit()
+        except Exception, e:
+            session.rollback()
+            self.log.error("Removing old jobs failed: %r" % e)
+
+        if removed:
+            self.log.info("Removed %d old jobs from db (%d job directories pending removal)." % \
+                (removed, self.reaper.pending))
+        return True
 
     @property
     def sfts(self):
@@ -113,22 +202,37 @@ class Housekeeper(object):
         """
         return self.sft_list
 
+    @property
+    def generation(self):
+        """
+        returns counter that changes whenever the 
+        list of SFTs has changed.
+        """
+        return self.sft_generation
+
     @property
     def scheduled_down_clusters(self):
         """ 
-            returns list of sites, respectively of
+            returns set of sites, respectively of
             the front-ends (aka clusters) that are
             on scheduled downtime.
         """
-        return self.down_clusters
+        return self.downtimes.down_clusters
 
     def main(self):
-        
+        """ 
+        housekeeping chores, to be called once per minute. 
+        Notice, SFTs get refreshed by refresh_sfts(). Every 
+        refresh_period all SFTs get checked, in case the SFTs 
+        have been changed without bumping the configuration version.
+        """
         self.__refresh_down_clusters()
 
-        self.sft_refresh_cnt -= 1
-        if self.sft_refresh_cnt <= 0:
-            self.__refresh_SFTs()
-            self.__clean_jobs()
-            self.sft_refresh_cnt = g.config.refresh_period
+        self.clean_cnt -= 1
+        if self.clean_cnt <= 0:
+            self.refresh_sfts(force = True)
+            if self.__clean_jobs():
+                self.clean_cnt = g.config.refresh_period
+            else:
+                self.clean_cnt = 1 # continue with next chunks in a minute
 
@@ -1,6 +1,6 @@
 """
-Nagios notification module. Uses the curl  protocol to 
-push SFT notifications to a nagios server. On the
+Nagios notification module. Pushes SFT notifications
+to a nagios server, over HTTP (keep-alive) or with curl. On the
 nagios server site we recommend to install 
 the NSCAweb (http://wiki.smetj.net/wiki/Nscaweb) module, as
 we will submit multi-line notifications, which
@@ -13,11 +13,18 @@ __author__ = "Placi Flury grid@switch.ch"
 __date__ = "16.02.2012"
 __version__ = "0.2.0"
 
+import re
 import time
 import logging
 import Queue
+import httplib
+import socket
+import urllib
+from threading import Thread, Event, Lock
+from collections import deque, OrderedDict
 from subprocess import Popen, PIPE
 from errors.nagios import NagiosNotifierError
+from utils.spool import Spool
 
 
 class NagiosNotification(object):
@@ -55,9 +62,25 @@ class NagiosNotification(object):
     def set_perf_data(self, perfdata):
         """ Adding (service) performance data. 
             
-            perfdata - string with performance data
+            perfdata - string with performance data, in nagios 
+                       format ('label'=value[UOM] ...) 
         """
-        self.perf_data = '%r' % perfdata 
+        self.perf_data = str(perfdata)
+
+    def add_perf_data(self, label, value, uom = ''):
+        """ Adds a single (service) performance value. 
+
+            label - name of value
+            value - number (float values get rounded to ms precision)
+            uom - unit of measurement, e.g. 's' for seconds
+        """
+        if isinstance(value, float):
+            value = '%.3f' % value
+        _perf = "'%s'=%s%s" % (label, value, uom)
+        if self.perf_data:
+            self.perf_data += ' ' + _perf
+        else:
+            self.perf_data = _perf
        
     def get_perf_data(self):
         """ Returns performance data of service (if any) """
@@ -97,10 +120,220 @@ class NagiosNotification(object):
         
  
 
+class NotificationSender(Thread):
+    """ Thread sending the check results (lines) of its queue to the 
+        nscaweb host. Up to 'batch_size' lines are sent with one request.
+        If a spool directory is configured, check results are spooled
+        on disk (see sft.utils.spool) until they've been sent. Failed 
+        requests are then retried (every RETRY_INTERVAL secs), 
+        and check results survive restarts of the daemon.
+        
+        Backends:
+            http - posts over a persistent (keep-alive) HTTP connection 
+            curl - one curl call per request 
+    """
+
+    RETRY_INTERVAL = 30 # secs
+
+    def __init__(self, config):
+        """ config - global config object """
+        Thread.__init__(self, name = 'NotificationSender')
+        self.log = logging.getLogger(__name__)
+        self.setDaemon(True)
+        self.lineq = Queue.Queue(0)
+
+        self.backend = config.nscaweb_backend
+        if self.backend not in ('http', 'curl'):
+            raise NagiosNotifierError('Invalid backend', 
+                "Unknown nscaweb backend '%s'." % self.backend)
+        self.batch_size = config.nscaweb_batch_size
+        self.timeout = config.nscaweb_timeout
+        self.curl_bin = config.curl_bin
+        self.nscaweb_host = config.nscaweb_host
+        self.nscaweb_port = int(config.nscaweb_port)
+        self.nscaweb_path = '/queue/' + config.nscaweb_queue
+        self.nscaweb_endpoint = config.nscaweb_host + ':' + \
+                str(config.nscaweb_port) + self.nscaweb_path
+        self.nscaweb_user = config.nscaweb_user
+        self.nscaweb_pwd = config.nscaweb_pwd
+        self.conn = None
+        self.started = False
+
+        self.spool = None
+        self.wakeup = Event()
+        if config.nscaweb_spool_dir:
+            self.spool = Spool(config.nscaweb_spool_dir, 
+                    config.nscaweb_spool_max_segments)
+
+    def add(self, lines):
+        """ queues lines (check results) for sending. The thread gets 
+            started with the first lines, i.e. only once the process
+            has been daemonized.
+        """
+        lines = [line.replace('\n', ' ') for line in lines] # one check result per line
+        if self.spool:
+            self.spool.append(lines)
+            self.wakeup.set()
+        else:
+            for line in lines:
+                self.lineq.put(line)
+        if not self.started:
+            self.started = True
+            self.start()
+
+    def __post_http(self, body):
+        """ posts body over persistent connection, which gets 
+            reopened once if it was closed by the server.
+        """
+        headers = {'Content-Type': 'application/x-www-form-urlencoded',
+                'Connection': 'keep-alive'}
+        for attempt in (1, 2):
+            if not self.conn:
+                self.conn = httplib.HTTPConnection(self.nscaweb_host, 
+                        self.nscaweb_port, timeout = self.timeout)
+            try:
+                self.conn.request('POST', self.nscaweb_path, body, headers)
+                response = self.conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise NagiosNotifierError('nscaweb error', 
+                        "nscaweb replied with '%d %s'." % (response.status, response.reason))
+                return
+            except (httplib.HTTPException, socket.error):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+    def __post_curl(self, _input):
+        """ posts input with curl """
+        call = Popen([self.curl_bin, '-s', '-m', str(self.timeout),
+                    '-d',  'username=%s' %  self.nscaweb_user, 
+                    '-d',  'password=%s' % self.nscaweb_pwd, 
+                    '--data-urlencode', 
+                     "input=%s" % _input,
+                    self.nscaweb_endpoint], stdout = PIPE, stderr = PIPE)
+        call.communicate()
+        if call.returncode != 0:
+            raise NagiosNotifierError('curl error', 
+                "curl exited with '%d'." % call.returncode)
+
+    def send(self, lines):
+        """ sends lines (check results) with one request """
+        _input = '\n'.join(lines)
+        if self.backend == 'curl':
+            self.__post_curl(_input)
+        else:
+            self.__post_http(urllib.urlencode(dict(username = self.nscaweb_user, 
+                password = self.nscaweb_pwd, input = _input)))
+
+    def __run_spooled(self):
+        """ sends spooled check results in the order they were spooled """
+        while True:
+            self.wakeup.clear()
+            lines, position = self.spool.peek(self.batch_size)
+            if not lines:
+                self.wakeup.wait(NotificationSender.RETRY_INTERVAL)
+                continue
+            try:
+                self.send(lines)
+                self.spool.commit(position)
+                self.log.debug("Sent %d notifications." % len(lines))
+            except Exception, e:
+                self.log.error("Sending %d notifications failed with %r, retrying in %d secs." % \
+                    (len(lines), e, NotificationSender.RETRY_INTERVAL))
+                time.sleep(NotificationSender.RETRY_INTERVAL)
+
+    def run(self):
+        if self.spool:
+            self.__run_spooled()
+            return
+        while True:
+            lines = [self.lineq.get()]
+            while len(lines) < self.batch_size:
+                try:
+                    lines.append(self.lineq.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                self.send(lines)
+                self.log.debug("Sent %d notifications." % len(lines))
+            except Exception, e:
+                self.log.error("Sending %d notifications failed with %r" % \
+                    (len(lines), e))
+
+
+class NotificationBuffer(object):
+    """ Keeps the most recent notifications of a host/service pair, 
+        i.e. at most 'size' messages plus the number of dropped older 
+        ones, the aggregated status of all notifications and their 
+        performance data (merged per label, most recent value wins).
+    """
+
+    MAX_MESSAGE_LENGTH = 512 # longer messages get truncated
+    PERF_DATA = re.compile(r"('[^']*'|[^\s=]+)=(\S*)") # label=value[UOM][;warn...]
+
+    def __init__(self, size):
+        self.messages = deque(maxlen = max(size, 1))
+        self.dropped = 0
+        self.status = None      # status of most recent notification
+        self.non_ok = False     # whether any notification was not OK
+        self.perf_data = OrderedDict() # label -> value of performance data
+
+    def add(self, notification):
+        """ adds notification (NagiosNotification object) """
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped += 1
+        _msg = notification.get_status(nsca_coded=False) + ': ' + \
+                str(notification.get_message())
+        if len(_msg) > NotificationBuffer.MAX_MESSAGE_LENGTH:
+            _msg = _msg[:NotificationBuffer.MAX_MESSAGE_LENGTH - 3] + '...'
+        self.messages.append(_msg)
+        self.status = notification.get_status()
+        if self.status != 0:
+            self.non_ok = True
+        if notification.has_perf_data():
+            for label, value in NotificationBuffer.PERF_DATA.findall(
+                    notification.get_perf_data()):
+                self.perf_data[label] = value
+
+    def get_perf_data(self):
+        """ returns merged performance data (nagios format), or 
+            None if there is none. 
+        """
+        if not self.perf_data:
+            return None
+        return ' '.join(['%s=%s' % (label, value) 
+                for label, value in self.perf_data.items()])
+
+    def get_status(self):
+        """ returns (nsca coded) status of most recent notification. 
+            It changes from OK to WARNING if any other notification 
+            was not OK. 
+        """
+        if self.status == 0 and self.non_ok:
+            return 1
+        return self.status
+
+    def get_messages(self, trace = True):
+        """ returns messages, most recent first, or only the most 
+            recent message if trace is False.
+        """
+        messages = list(self.messages)
+        messages.reverse()
+        if not trace:
+            return messages[:1]
+        if self.dropped:
+            messages.append('(%d older messages dropped)' % self.dropped)
+        return messages
+
+
 class NagiosNotifier(object):
     """ Nagios notification class. Collects 
-        various status messages and notifies Nagios
-        server via the curl protocol.
+        various status messages (per host/service pair,
+        see NotificationBuffer) and hands them over
+        to a sender thread (see NotificationSender), which
+        notifies the Nagios server.
     """
 
     def __init__(self, config):
@@ -109,90 +342,98 @@ class NagiosNotifier(object):
         """
         self.log = logging.getLogger(__name__)
 
-        self.curl_bin = config.curl_bin
-
-        self.nscaweb_endpoint = config.nscaweb_host + ':' + \
-                str(config.nscaweb_port) +'/queue/' + \
-                 config.nscaweb_queue
-        self.nscaweb_port = config.nscaweb_port
-        self.nscaweb_user = config.nscaweb_user
-        self.nscaweb_pwd = config.nscaweb_pwd
+        self.buffers = {}   # (host, service) -> NotificationBuffer
+        self.max_messages = config.notify_max_messages
+        self.lock = Lock()
+        self.sender = NotificationSender(config)
 
-        self.queue = Queue.LifoQueue(0) # notifications queue
+        self.changes_only = config.notify_changes_only
+        self.heartbeat = config.notify_heartbeat
+        self.last_sent = {} # (host, service) -> (status, time) of last sent check result
 
     
     def add_notification(self, notification):
         """ 
-        Adds notification to notification queue.
+        Adds notification to the buffer of its host/service pair.
         
         notification - NagiosNotfication object
         """
-        self.queue.put(notification)
+        key = (notification.get_host(), notification.get_service())
+        self.lock.acquire()
+        try:
+            if not self.buffers.has_key(key):
+                self.buffers[key] = NotificationBuffer(self.max_messages)
+            self.buffers[key].add(notification)
+        finally:
+            self.lock.release()
+
+    def __is_due(self, key, status, now):
+        """ returns True if a check result with given status must be sent 
+            for key (host, service). Unless only changes are to be sent, 
+            check results are always due. Otherwise, they are only due 
+            if the status changed since the last check result that was 
+            sent for key, or if the heartbeat interval expired.
+        """
+        if not self.changes_only:
+            return True
+        if not self.last_sent.has_key(key):
+            return True
+        last_status, last_time = self.last_sent[key]
+        return last_status != status or now - last_time >= self.heartbeat
 
     def notify(self, trace=True):
         """ 
         Push notifications to nscaweb host (usually running nagios server). 
+        The notifications are only queued for the sender thread, hence
+        this call never blocks on the network.
+        If 'notify_changes_only' is set, a host/service pair only gets 
+        notified if its status changed, or if it has not been notified 
+        for 'notify_heartbeat' seconds. 
 
         params:
         trace - if set true (default), the notifications for the same 
                 host/service pairs will be sent as chronological
-                traces (like stack traces).
+                traces (like stack traces), of at most 'notify_max_messages'
+                messages (most recent first). 
                 if set false, only the most recent  notification for
                 a host/service pair will be sent (older notifications
                 are masked out). 
         """
         # curl_msg: [TIMESTAMP] COMMAND_NAME;argument1;argument2;...;argumentN
-        if not trace:
-            pass
-        else: 
-            hs_msg_stack = {}
-            hs_perf_data = {}
-            hs_fin_status = {}
-
-            while not self.queue.empty():
-                _note = self.queue.get()
-                _status = _note.get_status()
-                
-                
-                key = (_note.get_host(), _note.get_service())   
-            
-                if not hs_msg_stack.has_key(key):
-                    hs_msg_stack[key] = []
-                    hs_fin_status[key] = _status
-                    if _note.has_perf_data():
-                        hs_perf_data[key] = _note.get_perf_data()
-
-                _msg = _note.get_status(nsca_coded=False) + ': ' +  _note.get_message()
-                hs_msg_stack[key].append(_msg)
-                
-                # fin status changes from OK to WARN for any non-OK sub-test that 
-                # had any problem
-                if hs_fin_status[key] == 0 and _status != 0:
-                    hs_fin_status[key] = 1
-
-            for k in hs_msg_stack.keys():
-
-                timestamp = int(time.time())
-
-                curl_msg = ('[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%s;%s' % \
-                        (timestamp, k[0], k[1], 
-                        hs_fin_status[k],
-                        hs_msg_stack[k]))
-
-                if hs_perf_data.has_key(k):
-                    curl_msg += ("|%s" % hs_perf_data[k])
-
-                self.log.debug("username=%s'" % self.nscaweb_user) 
- 
-                Popen([self.curl_bin,  
-                            '-d',  'username=%s' %  self.nscaweb_user, 
-                            '-d',  'password=%s' % self.nscaweb_pwd, 
-                            '--data-urlencode', 
-                             "input=%s" % curl_msg ,
-                            self.nscaweb_endpoint], stdout=PIPE)
-
-                self.log.debug('Sent notification >%s<.' % curl_msg)
-                
+        self.lock.acquire()
+        try:
+            buffers = self.buffers
+            self.buffers = {}
+        finally:
+            self.lock.release()
+
+        lines = []
+        skipped = 0
+        timestamp = int(time.time())
+        for k, buf in buffers.items():
+
+            fin_status = buf.get_status()
+            if not self.__is_due(k, fin_status, timestamp):
+                skipped += 1
+                continue
+            self.last_sent[k] = (fin_status, timestamp)
+
+            curl_msg = ('[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%s;%s' % \
+                    (timestamp, k[0], k[1], 
+                    fin_status,
+                    buf.get_messages(trace)))
+
+            perf_data = buf.get_perf_data()
+            if perf_data:
+                curl_msg += ("|%s" % perf_data)
+
+            lines.append(curl_msg)
+            self.log.debug('Queued notification >%s<.' % curl_msg)
+
+        if skipped:
+            self.log.debug("Skipped %d notifications without status change." % skipped)
+        if lines:
+            self.sender.add(lines)
             
 
 if __name__ == '__main__':
@@ -5,10 +5,13 @@ that got submitted.
 """
 import logging
 import os, os.path,  hashlib
-import subprocess
+from Queue import Queue, Empty
+from threading import Thread
 from sqlalchemy import and_ as AND
 from sqlalchemy import or_ as OR
-from datetime import datetime
+from sqlalchemy import not_ as NOT
+from sqlalchemy import bindparam
+from datetime import datetime, timedelta
 from sft.utils import helpers
 
 import db.sft_meta as meta
@@ -36,10 +39,23 @@ class Publisher(object):
     FIN_STATES = ['failed', 'fetched', 'fetched_failed', 
                 'timeout'] + GRID_FIN_STATES
     TIMEOUT = 20
+    STAT_BATCH_SIZE = 50    # max number of jobs queried by one arcstat call
+    FETCH_BATCH_SIZE = 10   # max number of jobs fetched by one arcget call
+
+    # adaptive polling of job states [secs]
+    MIN_CHECK_DELAY = 60    # lower bound of backoff
+    RUNNING_CHECK_DELAY = 60  # fixed delay for running jobs (no backoff)
+    MAX_CHECK_DELAY = 1800  # upper bound of backoff for waiting jobs
+    CHECK_BACKOFF = 0.25    # delay of waiting jobs as fraction of their age
+    POLL_RETENTION = 2 * MAX_CHECK_DELAY # secs poll details of jobs are kept
+    RUNNING_STATES = ('INLRMS:R', 'INLRMS:E', 'INLRMS:EXECUTED', 
+                'FINISHING', 'RUNNING')
 
     def __init__(self):
         self.log = logging.getLogger(__name__)
         self.session = meta.Session
+        self.job_polls = {}   # id of active job -> (last polled, arcstat secs) 
+        self.sweeper_status = None # status of last sweeper notification
         self.jobsdir = g.config.jobsdir
         self.joblist = os.path.join(self.jobsdir, 'jobs.xml')
         self.log.info("Jobs download directory set to '%s'" % self.jobsdir)
@@ -77,19 +93,20 @@ class Publisher(object):
         self.neg_dn_vos = []
 
 
-    def __set_x509_user_proxy(self, DN, vo_name):
+    def __get_x509_user_proxy(self, DN, vo_name):
         """
-        Try to set X509_USER_PROXY environment variable
-        to a vomsproxy for user DN and VO vo.
-        returns True, if environment variable could be set
-                False, else
+        Try to get a vomsproxy for user DN and VO vo. The
+        returned proxy file is meant to be passed to the arc 
+        commands (see helpers.timeout_call).
+        returns path of voms proxy file, if proxy could be created 
+                None, else
         """
         if (DN, vo_name) in self.neg_dn_vos:
-            return False
+            return None
         
         user = self.session.query(schema.User).filter_by(DN=DN).first()
         if not user:
-            return False
+            return None
         passwd = user.get_passwd()
         file_prefix = hashlib.md5(DN).hexdigest() 
         myproxy_file = os.path.join(g.config.proxy_dir, file_prefix)
@@ -107,160 +124,421 @@ class Publisher(object):
                 _notification.set_status('CRITICAL')
                 g.notifier.add_notification(_notification)
                 self.neg_dn_vos.append((DN, vo_name))
-                return False   
+                return None
             
             self.pos_dn_vos.append((DN, vo_name))
 
-        os.environ['X509_USER_PROXY'] = voms_proxy_file
-        return True
+        return voms_proxy_file
 
 
-    def check_submitted_jobs(self):
-        """ checking whether submitted jobs can be fetched."""
-       
-        for entry in self.session.query(schema.SFTJob).\
-            filter(AND(schema.SFTJob.status != 'failed',
-                schema.SFTJob.status != 'fetched',
-                schema.SFTJob.status != 'success',
-                schema.SFTJob.status != 'fetched_failed',
-                schema.SFTJob.status != 'fetch_failed',
-                schema.SFTJob.status != 'test_failed',
-                schema.SFTJob.status != 'timeout',
-                schema.SFTJob.status != 'FAILED',
-                schema.SFTJob.status != 'FINISHED',
-                schema.SFTJob.status != 'KILLED',
-                schema.SFTJob.status != 'DELETED')).all():
-
-            self.log.debug("Checking job in state: %s" % entry.status)
+    def parse_arcstat(self, output):
+        """ Parses the output of an arcstat call on (possibly) many jobs. 
+            Every job is listed as:
+                Job: <jobid>
+                 Name: <job name>
+                 State: <state> (<grid state>)
+                 [Exit Code: <code>]
             
-            DN = entry.DN
-            vo_name = entry.vo_name 
-            if not self.__set_x509_user_proxy(DN, vo_name):
-                continue 
-
-            self.log.debug("Querying status of job: %s" % entry.jobid.strip())
+            returns dictionary jobid -> grid state (the state in '()')
+        """
+        states = {}
+        jobid = None
+        for line in output.split('\n'):
+            line = line.strip()
+            if line.startswith('Job:'):
+                jobid = line[len('Job:'):].strip()
+            elif jobid and (line.startswith('State:') or line.startswith('Status:')):
+                if '(' not in line:
+                    continue  # state is presented in ()
+                states[jobid] = line.rsplit('(', 1)[1].strip(') ')
+        return states
+
+    def next_check_time(self, status, submissiontime, now):
+        """ returns time the state of a job should be queried next.
+            Job states get queried with an exponential backoff, i.e. 
+            with a delay proportional to the age of the job, of at least
+            MIN_CHECK_DELAY secs and at most MAX_CHECK_DELAY secs. Running 
+            jobs (i.e. near completion) get queried with the short fixed 
+            delay RUNNING_CHECK_DELAY instead, so their results get 
+            fetched soon after they complete.
+
+            status - current (grid) state of job
+            submissiontime - submission time of job
+            now - current time (datetime, UTC)
+        """
+        if status in Publisher.RUNNING_STATES:
+            return now + timedelta(seconds = Publisher.RUNNING_CHECK_DELAY)
+        if not submissiontime:
+            return now + timedelta(seconds = Publisher.MIN_CHECK_DELAY)
+
+        age = now - submissiontime
+        age = age.days * 86400 + age.seconds
+        delay = min(max(age * Publisher.CHECK_BACKOFF, Publisher.MIN_CHECK_DELAY), 
+                Publisher.MAX_CHECK_DELAY)
+        return now + timedelta(seconds = delay)
+
+    def __stat_jobs(self, entries, voms_proxy_file):
+        """ queries the states of the given jobs with one arcstat call.
+            The entries of all queried jobs get their next check time
+            set, the ones of jobs whose state changed their new state
+            (in memory only). The duration of the arcstat call is kept 
+            in memory (see job_polls).
+            entries - sft_job rows (dictionaries) of jobs belonging to the 
+                      same (DN, VO) and stored in the same job list
+            voms_proxy_file - proxy credential of (DN, VO)
+
+            returns list of entries whose status changed
+        """
+        jobs = dict([(entry['jobid'].strip(), entry) for entry in entries])
+        joblist = entries[0]['joblist'] or self.joblist
 
-            cmd = '%s -j %s %s' % (self.arcstat, self.joblist,entry.jobid.strip())
-            
+        cmd = '%s -j %s %s' % (self.arcstat, joblist, ' '.join(jobs.keys()))
+        timeout = Publisher.TIMEOUT + len(jobs)  # some slack for larger batches
+        lock = helpers.get_joblist_lock(joblist)
+        lock.acquire()
+        try:
             try:
-                outdata, err, return_code  = helpers.timeout_call(cmd, Publisher.TIMEOUT)
+                outdata, err, return_code, stat_time  = helpers.get_executor().execute(cmd, timeout,
+                        x509_user_proxy = voms_proxy_file)
             except helpers.Alarm:
+                self.log.error("Querying status of %d jobs timed out after (%d secs)" % \
+                    (len(jobs), timeout))
+                return []
+            except OSError, e:
+                self.log.error("Querying status of %d jobs failed with %r" % \
+                    (len(jobs), e))
+                return []
+        finally:
+            lock.release()
+
+        states = self.parse_arcstat(outdata)
+        now = datetime.utcnow()
+        changed = []
+        for jobid, status in states.items():
+            entry = jobs.get(jobid)
+            if not entry:
                 continue
+            self.log.debug("Refreshed job status of %s:>%s<" % (jobid, status))
+            if entry['status'] != status:
+                entry['status'] = status
+                changed.append(entry)
+
+        if return_code != 0:
+            _error_msg = outdata + 'Error: ' + err
+            self.log.debug("Quering job status failed with %s" % _error_msg)
+
+        # hack to intercept jobs that got 'lost'
+        lost = []
+        if return_code != 0 and 'No jobs given' in err:
+            lost = [jobid for jobid in jobs.keys() if not states.has_key(jobid)]
+        else:
+            for line in (outdata + '\n' + err).split('\n'):
+                if 'Job not found' in line:
+                    lost += [jobid for jobid in jobs.keys() if jobid in line]
+
+        for jobid in lost:
+            entry = jobs[jobid]
+            entry['status'] = 'fetch_failed'
+            entry['error_type'] = 'sft'
+            entry['error_msg'] = "Job '%s' not found anymore" % jobid
+            if entry not in changed:
+                changed.append(entry)
+
+        for entry in entries:
+            entry['next_check_time'] = self.next_check_time(entry['status'], 
+                    entry['submissiontime'], now)
+            self.job_polls[entry['id']] = (now, stat_time)
+        for entry in changed:
+            entry['is_active'] = schema.is_active_status(entry['status'])
+            entry['db_lastmodified'] = now
+
+        return changed
+
+    def __write_check_times(self, entries):
+        """ writes next check times of jobs with one (executemany) 
+            UPDATE (without commit).
+            entries - sft_job rows (dictionaries) of jobs whose status didn't change
+        """
+        if not entries:
+            return
+        t_job = schema.t_sft_job
+        self.session.execute(t_job.update().\
+                where(t_job.c.id == bindparam('_id')).\
+                values(next_check_time = bindparam('_next_check_time')),
+                [dict(_id = _entry['id'], _next_check_time = _entry['next_check_time'])
+                    for _entry in entries])
+
+    def __write_transitions(self, changed):
+        """ writes state transitions of jobs with one (executemany) 
+            UPDATE, and updates their latest results (without commit).
+            changed - sft_job rows (dictionaries) of jobs whose status changed
+        """
+        if not changed:
+            return
+        t_job = schema.t_sft_job
+        self.session.execute(t_job.update().\
+                where(t_job.c.id == bindparam('_id')).\
+                values(status = bindparam('_status'), 
+                    is_active = bindparam('_is_active'),
+                    error_type = bindparam('_error_type'),
+                    error_msg = bindparam('_error_msg'),
+                    next_check_time = bindparam('_next_check_time'),
+                    db_lastmodified = bindparam('_db_lastmodified')),
+                [dict([('_' + k, _entry[k]) for k in ('id', 'status', 'is_active', 
+                    'error_type', 'error_msg', 'next_check_time', 'db_lastmodified')])
+                    for _entry in changed])
+        helpers.update_latest_results(self.session, changed)
+        helpers.log_job_transitions(self.session, changed)
+        self.log.debug("Stored %d job state transitions." % len(changed))
 
-            if return_code == 0:
-                output = outdata.split('\n')  # Job, Job Name, Status, [Exit code]
-                if len(output) > 2:
-                    # some dirty hacking, as Status sometimes not present, no clue why.
-                    if not output[2]:
-                        continue
-                    status = output[2].split('(')[1].strip(') ') # state is presented in ()
-                    self.log.debug("Refreshed job status:>%s<" % status)
-                else:
-                    self.log.error("Parsing job status: '%s'" % output)
-                    continue
-                entry.status = status
-                entry.db_lastmodified = datetime.utcnow()
-                self.session.flush()
-            else:
-                _error_msg = outdata + 'Error: ' + err
-                self.log.debug("Quering job status failed with %s" % _error_msg)
-               
-                # hack to intercept jobs that got 'lost'
-                if 'No jobs given' in err:
-                    entry.status = 'fetch_failed'
-                    entry.error_type = 'sft'
-                    entry.error_msg = "Job '%s' not found anymore" % entry.jobid.strip()
+    def check_submitted_jobs(self):
+        """ checking whether submitted jobs can be fetched. Only jobs
+            that are due (see next_check_time) get checked. The jobs
+            are grouped by (DN, VO) and queried in batches of
+            STAT_BATCH_SIZE jobs per arcstat call. The state transitions
+            and the next check times of the other queried jobs get written 
+            to the db, with one UPDATE each.
+        """
+        t_job = schema.t_sft_job
+        dn_vo_jobs = {}  # (DN, VO, job list) -> list of sft_job rows (dictionaries)
+        changed = []     # sft_job rows of jobs whose status changed
+        queried = []     # sft_job rows of all queried jobs
+        now = datetime.utcnow()
+       
+        for row in self.session.execute(t_job.select().\
+            where(AND(t_job.c.is_active == True,
+                OR(t_job.c.next_check_time == None,
+                    t_job.c.next_check_time <= now),
+                NOT(t_job.c.status.in_(schema.FETCHABLE_JOB_STATES))))).fetchall():
+
+            entry = dict(row)
+            if not entry['jobid']:
+                continue
+            key = (entry['DN'], entry['vo_name'], entry['joblist'])
+            if not dn_vo_jobs.has_key(key):
+                dn_vo_jobs[key] = []
+            dn_vo_jobs[key].append(entry)
+
+        # forget about jobs that haven't been polled for long (not active anymore)
+        for _id, (polled, _) in self.job_polls.items():
+            if now - polled > timedelta(seconds = Publisher.POLL_RETENTION):
+                del self.job_polls[_id]
+
+        for (DN, vo_name, _), entries in dn_vo_jobs.items():
+            voms_proxy_file = self.__get_x509_user_proxy(DN, vo_name)
+            if not voms_proxy_file:
+                continue 
+
+            self.log.debug("Querying status of %d jobs of (%s, %s)" % \
+                (len(entries), DN, vo_name))
+            for i in xrange(0, len(entries), Publisher.STAT_BATCH_SIZE):
+                batch = entries[i:i + Publisher.STAT_BATCH_SIZE]
+                changed += self.__stat_jobs(batch, voms_proxy_file)
+                queried += batch
  
-        self.session.commit()
+        try:
+            self.__write_transitions(changed)
+            changed_ids = set([_entry['id'] for _entry in changed])
+            self.__write_check_times([_entry for _entry in queried 
+                    if _entry['id'] not in changed_ids])
+            self.session.commit()
+        except Exception, e:
+            self.session.rollback()
+            self.log.error("Storing %d job state transitions failed with %r" % \
+                (len(changed), e))
+
+    def __process_fetch_result(self, entry, fetched, fetch_time = None):
+        """ updates db entry (without commit) and notifies nagios 
+            about the outcome of fetching the job of entry. The job 
+            turnaround, arcget and (last) arcstat times are added to 
+            the notification as performance data.
+            fetched - True if job could be fetched
+            fetch_time - secs the arcget call (of the job's batch) took
+        """
+        jobid = entry.jobid.strip()
+        if fetched:
+            outdir = os.path.join(self.jobsdir, jobid.split('/jobs/')[1])
+            if entry.status == 'FAILED':
+                entry.set_status('fetched_failed')
+                entry.error_type = 'lrms'
+                entry.error_msg = "Feching job '%s' failed" % jobid
+            else:
+                # check whether test logically failed.
+                status, entry.error_type, entry.error_msg  = self.check_test_succeeded(outdir) 
+                entry.set_status(status)
+            try:
+                self.html_indexer.set_path(outdir)
+                self.html_indexer.generate()
+                entry.outputdir = self.html_indexer.get_logical_path()
+            except HTMLIndexerError, e: 
+                self.log.error("%s:  %s" % ( e.expression, e.message))
+                entry.outputdir = outdir + '(indexer error)' 
+            entry.db_lastmodified = datetime.utcnow()
+        else: 
+            entry.set_status('fetch_failed')
+            entry.error_type = 'lrms'
+            entry.error_msg = 'Job could not be retrieved anymore '
+
+        _notification = NagiosNotification(entry.cluster_name, entry.sft_test_name)
+        if entry.status == 'success':
+            _notification.set_status('OK')
+            _msg = '(%s) successfully executed' % entry.test_name
+        else:
+            _notification.set_status('CRITICAL')
+            _msg = '(%s) execution faile' % entry.test_name
+        _notification.set_message(_msg)
+        if entry.submissiontime:
+            turnaround = datetime.utcnow() - entry.submissiontime
+            _notification.add_perf_data('turnaround', 
+                    turnaround.days * 86400 + turnaround.seconds, 's')
+        if fetch_time is not None:
+            _notification.add_perf_data('arcget', fetch_time, 's')
+        if self.job_polls.has_key(entry.id):
+            _notification.add_perf_data('arcstat', self.job_polls.pop(entry.id)[1], 's')
+        g.notifier.add_notification(_notification)
+
+    def __fetch_worker(self, taskq, resultq):
+        """ downloads batches of jobs from taskq, until it's empty, and
+            puts the (jobids, fetched jobids, download secs) outcomes on resultq. 
+        """
+        while True:
+            try:
+                jobids, voms_proxy_file, joblist = taskq.get_nowait()
+            except Empty:
+                return
+            try:
+                fetched, fetch_time = self.fetch_jobs(jobids, voms_proxy_file, 
+                        joblist, with_time = True)
+            except Exception, e:
+                self.log.error("Fetching jobs %r failed with %r" % (jobids, e))
+                fetched, fetch_time = [], None
+            resultq.put((jobids, fetched, fetch_time))
 
     def fetch_final_jobs(self):
-        """ fetching all jobs in final state, that were not yet fetched. """
-
+        """ fetching all jobs in final state, that were not yet fetched. 
+            Jobs get fetched in batches per (DN, VO, cluster, job list). Batches of different 
+            clusters are downloaded in parallel by up to 'fetch_threads' threads,
+            and the results are processed as soon as a batch is downloaded.
+        """
+        batches = {}  # (DN, VO, cluster, job list) -> list of SFTJob objects
         for entry in self.session.query(schema.SFTJob).\
-            filter(OR(schema.SFTJob.status == 'FAILED',
-                schema.SFTJob.status == 'FINISHED')).all():
+            filter(AND(schema.SFTJob.is_active == True,
+                schema.SFTJob.status.in_(schema.FETCHABLE_JOB_STATES))).all():
             # since filter is case insensitive, let's skip 'failed' status
-            jobid = entry.jobid
-            if not jobid:
+            if entry.status not in schema.FETCHABLE_JOB_STATES or not entry.jobid:
                 continue
-            jobid = jobid.strip()
-            
-            DN = entry.DN
-            vo_name = entry.vo_name 
-            if not self.__set_x509_user_proxy(DN, vo_name):
+            key = (entry.DN, entry.vo_name, entry.cluster_name, entry.joblist)
+            if not batches.has_key(key):
+                batches[key] = []
+            batches[key].append(entry)
+
+        taskq = Queue(0)
+        resultq = Queue(0)
+        jobs = {}   # jobid -> SFTJob object
+        processed = [] # SFTJob objects whose fetch result has been processed
+        tasks = []  # (batch number, cluster, jobids, voms_proxy_file, job list)
+        for (DN, vo_name, cluster, joblist), entries in batches.items():
+            voms_proxy_file = self.__get_x509_user_proxy(DN, vo_name)
+            if not voms_proxy_file:
                 continue 
-
-            nstatus = self.fetch_job(jobid)
-            self.log.debug("Fetching job status: %s" % nstatus)
-            if nstatus == 'fetched':
-                outdir = os.path.join(self.jobsdir, jobid.split('/jobs/')[1])
-                if entry.status == 'FAILED':
-                    entry.status = 'fetched_failed'
-                    entry.error_type = 'lrms'
-                    entry.error_msg = "Feching job '%s' failed" % jobid
-                else:
-                    # check whether test logically failed.
-                    entry.status, entry.error_type, entry.error_msg  = self.check_test_succeeded(outdir) 
-                try:
-                    self.html_indexer.set_path(outdir)
-                    self.html_indexer.generate()
-                    entry.outputdir = self.html_indexer.get_logical_path()
-                except HTMLIndexerError, e: 
-                    self.log.error("%s:  %s" % ( e.expression, e.message))
-                    entry.outputdir = outdir + '(indexer error)' 
-                entry.db_lastmodified = datetime.utcnow()
-
-                self.session.flush()
-                
-            else: 
-                entry.status = 'fetch_failed'
-                entry.error_type = 'lrms'
-                entry.error_msg = 'Job could not be retrieved anymore '
-
-
-            _notification = NagiosNotification(entry.cluster_name, entry.sft_test_name)
-            if entry.status == 'success':
-                _notification.set_status('OK')
-                _msg = '(%s) successfully executed' % entry.test_name
-            else:
-                _notification.set_status('CRITICAL')
-                _msg = '(%s) execution faile' % entry.test_name
-            _notification.set_message(_msg)
-            g.notifier.add_notification(_notification)
+            for n, i in enumerate(xrange(0, len(entries), Publisher.FETCH_BATCH_SIZE)):
+                jobids = []
+                for entry in entries[i:i + Publisher.FETCH_BATCH_SIZE]:
+                    jobid = entry.jobid.strip()
+                    jobs[jobid] = entry
+                    jobids.append(jobid)
+                tasks.append((n, cluster, jobids, voms_proxy_file, joblist))
+
+        # interleave clusters, so that parallel downloads hit different clusters
+        tasks.sort()
+        for _, _, jobids, voms_proxy_file, joblist in tasks:
+            taskq.put((jobids, voms_proxy_file, joblist))
+
+        for _ in xrange(min(g.config.fetch_threads, len(tasks))):
+            worker = Thread(target = self.__fetch_worker, args = (taskq, resultq))
+            worker.setDaemon(True)
+            worker.start()
+
+        for _ in xrange(len(tasks)):
+            jobids, fetched, fetch_time = resultq.get()
+            self.log.debug("Fetched %d of %d jobs" % (len(fetched), len(jobids)))
+            for jobid in jobids:
+                self.__process_fetch_result(jobs[jobid], jobid in fetched, fetch_time)
+            processed += [jobs[jobid] for jobid in jobids]
         
+        helpers.update_latest_results(self.session, processed)
+        helpers.log_job_transitions(self.session, processed)
         self.session.commit()
 
 
-    def fetch_job(self, jobid):
-        """ fetching the specified job. 
-            Returns: fetched - if job could be fetched
-                     failed  - is something went wrong. 
-            
-            if failed: with get_last_error(), an error message 
-            can be fetched. 
+    def fetch_jobs(self, jobids, voms_proxy_file = None, joblist = None, 
+                with_time = False):
+        """ fetching the specified jobs with one arcget call.
+            jobids - list of job ids
+            voms_proxy_file - proxy credential used to fetch jobs
+            joblist - arc job list the jobs are stored in, defaults to 
+                      <jobsdir>/jobs.xml
+            with_time - if True, the secs the arcget call took (None if 
+                      it timed out) get returned as well
+            Returns: list of jobids that could be fetched, or 
+                     (list of jobids, arcget secs) if with_time is set.
         """    
-        cmd = '%s -j %s -D %s %s' % (self.arcget, self.joblist, self.jobsdir, jobid.strip() )
+        if not joblist:
+            joblist = self.joblist
+        cmd = '%s -j %s -D %s %s' % (self.arcget, joblist, self.jobsdir, 
+                ' '.join(jobids))
+        timeout = Publisher.TIMEOUT * len(jobids)
     
         # as ret.wait() sets return codes != 0 even for success, we therefore
         # need to parse the output ;-(
-        
+        lock = helpers.get_joblist_lock(joblist) # arcget removes jobs from job list
+        lock.acquire()
         try:
-            output, stderr, return_code  = helpers.timeout_call(cmd, Publisher.TIMEOUT)
-        except helpers.Alarm:
-            pass 
+            try:
+                output, stderr, return_code, wall_time = helpers.get_executor().execute(cmd, 
+                        timeout, x509_user_proxy = voms_proxy_file)
+            except helpers.Alarm:
+                self.log.error("Fetching jobs %r timed out after (%d secs)" % 
+                    (jobids, timeout))
+                if with_time:
+                    return [], None
+                return []
+        finally:
+            lock.release()
         self.log.debug("arcget output:>%s<, stderr:>%s<" % (output.strip('\n'), stderr))
-    
         self.log.debug("return-code: %d" % return_code)
- 
-        if output and ('successfully' in output):
-            self.log.info("Stored job results at %s" % output.strip('\n'))
+
+        # 'Results stored at: <jobsdir>/<local job id>' for every fetched job
+        stored = set()
+        for line in output.split('\n'):
+            if 'stored at' in line:
+                stored.add(os.path.basename(line.split(':', 1)[1].strip().rstrip('/')))
+
+        fetched = []
+        for jobid in jobids:
+            if jobid.split('/jobs/')[-1] in stored:
+                self.log.info("Stored job results of %s" % jobid)
+                fetched.append(jobid)
+            elif len(jobids) == 1 and output and ('successfully' in output):
+                self.log.info("Stored job results at %s" % output.strip('\n'))
+                fetched.append(jobid)
+            else:
+                self.log.error("Fetching job '%s' failed with %s" % 
+                    (jobid, stderr))
+                # XXX need to intercept different kind of errors -> deal with them individually
+        if with_time:
+            return fetched, wall_time
+        return fetched
+
+    def fetch_job(self, jobid, voms_proxy_file = None):
+        """ fetching the specified job. 
+            voms_proxy_file - proxy credential used to fetch job
+            Returns: fetched - if job could be fetched
+                     failed  - is something went wrong. 
+        """    
+        if self.fetch_jobs([jobid.strip()], voms_proxy_file):
             return 'fetched'
-        else:
-            _error_msg = stderr
-            self.log.error("Fetching job '%s' failed with %s" % 
-                (jobid, _error_msg))
-            # XXX need to intercept different kind of errors -> deal with them individually
-            return 'failed'
+        return 'failed'
     
     def check_test_succeeded(self, outdir):
         """
@@ -309,10 +587,91 @@ class Publisher(object):
         return 'success', None, None
            
 
+    def sweep_overdue_jobs(self):
+        """ retires jobs that did not complete within their deadline, 
+            by setting their status to 'timeout' (with one UPDATE). The 
+            deadline is set per SFT (job_deadline), or by the 'job_deadline' 
+            option of the configuration. Jobs that completed (i.e. can be
+            fetched) are left alone. Sends one notification that 
+            summarizes all retired jobs, and an OK one once there 
+            are no overdue jobs anymore.
+        """
+        t_job = schema.t_sft_job
+        now = datetime.utcnow().replace(microsecond = 0) # as stored by db
+
+        deadlines = {}  # deadline [minutes] -> names of SFTs
+        explicit = []   # names of SFTs with their own deadline
+        for name, deadline in self.session.query(schema.SFTTest.name, 
+                schema.SFTTest.job_deadline).all():
+            if deadline:
+                explicit.append(name)
+                deadlines.setdefault(deadline, []).append(name)
+
+        clauses = []
+        for deadline, names in deadlines.items():
+            clauses.append(AND(t_job.c.sft_test_name.in_(names),
+                t_job.c.submissiontime < now - timedelta(minutes = deadline)))
+        default_clause = t_job.c.submissiontime < \
+                now - timedelta(minutes = g.config.job_deadline)
+        if explicit:
+            default_clause = AND(NOT(t_job.c.sft_test_name.in_(explicit)), default_clause)
+        clauses.append(default_clause)
+
+        _error_msg = 'Job did not complete within its deadline'
+        rows = []
+        try:
+            # deadline is checked by the UPDATE itself, so jobs that 
+            # complete meanwhile don't get retired
+            result = self.session.execute(t_job.update().\
+                    where(AND(t_job.c.is_active == True, 
+                        NOT(t_job.c.status.in_(schema.FETCHABLE_JOB_STATES)),
+                        OR(*clauses))).\
+                    values(status = 'timeout', is_active = False, error_type = 'sft', 
+                        error_msg = _error_msg, db_lastmodified = now))
+            if result.rowcount:
+                rows = [dict(row) for row in self.session.execute(t_job.select().\
+                        where(AND(t_job.c.status == 'timeout', 
+                            t_job.c.db_lastmodified == now))).fetchall()]
+                helpers.update_latest_results(self.session, rows)
+                helpers.log_job_transitions(self.session, rows, now = now)
+            self.session.commit()
+        except Exception, e:
+            self.session.rollback()
+            self.log.error("Retiring overdue jobs failed with %r" % e)
+            return
+
+        _notification = NagiosNotification(g.config.localhost, 'sweeper')
+        if rows:
+            per_sft = {}  # (SFT, cluster) -> number of retired jobs
+            for row in rows:
+                key = (row['sft_test_name'], row['cluster_name'])
+                per_sft[key] = per_sft.get(key, 0) + 1
+            self.log.info("Retired %d jobs that exceeded their deadline." % len(rows))
+
+            _notification.set_status('WARNING')
+            _notification.set_message('%d jobs timed out: %s' % (len(rows), 
+                ', '.join(['%s@%s (%d)' % (sft, cluster, n) 
+                    for (sft, cluster), n in sorted(per_sft.items())])))
+        elif self.sweeper_status != 'OK':
+            _notification.set_status('OK')
+            _notification.set_message('No jobs exceeded their deadline')
+        else:
+            return
+        self.sweeper_status = _notification.get_status(False)
+        g.notifier.add_notification(_notification)
+
+    def poll(self):
+        """ checks the submitted jobs that are due and fetches the 
+            completed ones. Meant to be called every cycle, as only 
+            due jobs get queried (see next_check_time). 
+        """
+        self.check_submitted_jobs()
+        self.fetch_final_jobs()
+
     def main(self):
         """ main method """
         self.reset_proxy_cache()
-        self.check_submitted_jobs()
-        self.fetch_final_jobs()
+        self.sweep_overdue_jobs()
+        self.poll()
 
  
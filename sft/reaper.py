@@ -0,0 +1,63 @@
+"""
+Removal of output directories of old SFT jobs.
+
+The directories are removed by a background thread at a limited
+rate, so neither the scheduler nor the disk get stalled by large
+numbers of expired jobs.
+"""
+__author__ = "Placi Flury grid@switch.ch"
+__date__ = "18.10.2026"
+__version__ = "0.1.0"
+
+import logging
+import time
+import shutil
+from Queue import Queue
+from threading import Thread
+
+
+class DirectoryReaper(Thread):
+    """ Thread removing directories that have been put in its queue,
+        at a rate of at most 'rate' directories per second. The thread
+        gets started with the first directory, i.e. only once the
+        process has been daemonized.
+    """
+
+    def __init__(self, rate):
+        """ rate - max number of directories removed per second """
+        Thread.__init__(self, name = 'DirectoryReaper')
+        self.log = logging.getLogger(__name__)
+        self.setDaemon(True)
+        self.dirq = Queue()
+        self.interval = 1.0 / max(rate, 1)
+        self.removed = 0
+        self.started = False
+
+    def add(self, path):
+        """ queues directory at path for removal """
+        self.dirq.put(path)
+        if not self.started:
+            self.started = True
+            self.start()
+
+    @property
+    def pending(self):
+        """ returns (approximate) number of directories waiting for removal """
+        return self.dirq.qsize()
+
+    def run(self):
+        while True:
+            path = self.dirq.get()
+            start = time.time()
+            self.log.debug("Removing job directory at '%s'" % path)
+            try:
+                shutil.rmtree(path)
+                self.removed += 1
+            except OSError, e:
+                self.log.debug("Removing '%s' failed: %r" % (path, e))
+            except Exception, e:
+                self.log.error("Removing '%s' failed: %r" % (path, e))
+
+            delay = self.interval - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
@@ -1,14 +1,25 @@
 """
 Scheduler for running and managing everything 
 around the SFT tests.
+
+SFTs are kept in a heap, ordered by their next execution
+time. The scheduler sleeps until either the earliest SFT is 
+due or the next housekeeping cycle starts.
 """
 import logging
 import time
+import calendar
+import heapq
+import itertools
+from datetime import datetime, timedelta
 from Queue import Queue, Empty
 from threading import Thread
 
 from sft.housekeeper import Housekeeper
 from sft.publisher import Publisher
+from sft.sft_event import SFT_Event
+from sft.snapshot import SnapshotWriter
+from sft.utils import helpers
 import sft.sft_globals as g
 
 class Scheduler(object):
@@ -16,33 +27,115 @@ class Scheduler(object):
     
     THREAD_LIMIT = 10       # max number of SFT threads
     CYCLE_TIME = 60         # in seconds
-    CHECK_INTERVAL = 10     # interval for status check  of submitted SFT jobs 
+    CHECK_INTERVAL = 10     # interval for sweeping overdue jobs and writing snapshots
+    ONE_MINUTE = timedelta(minutes=1)
     
     def __init__(self):
         self.log = logging.getLogger(__name__)        
         
         self.housekeeper = Housekeeper()
         self.publisher = Publisher()
+        self.snapshots = SnapshotWriter(g.config.url_root, g.config.snapshot_gzip)
         self.procq = Queue(0)  # no limit to queue,
         self.stop_threads = False
+        self.sft_heap = []      # (fire time [epoch], sequence, SFT) tupples
+        self.sft_generation = None # generation of SFTs the heap was built from
+        self.last_fired = {}    # SFT name -> datetime of last execution
+        self.sequence = itertools.count()
         self.log.info("Initialization finished")
     
 
     def _run_sfts(self):
         """ runs sfts that have been put
-            in processing queue """
+            in processing queue. SFTs are split into their 
+            individual job submissions, which are put back 
+            on the processing queue. """
 
         while not self.stop_threads:
             try:
-                sft, insert_time = self.procq.get(True, 30) # blocking for 30 secs than check stop event
+                task, insert_time = self.procq.get(True, 30) # blocking for 30 secs than check stop event
                 self.log.debug("Current queueing time: %s seconds" % (time.time() - insert_time))
-                sft.set_clusters_down(self.housekeeper.scheduled_down_clusters)
-                sft.run()
+                if isinstance(task, SFT_Event):
+                    # fan out SFT into its submissions, so they get run in parallel
+                    task.set_clusters_down(self.housekeeper.scheduled_down_clusters)
+                    for submission in task.get_submissions(insert_time):
+                        self.procq.put((submission, time.time()))
+                else:
+                    # waiting time since the SFT run got queued
+                    task.queue_wait = time.time() - (task.queued or insert_time)
+                    task.run()
             except Empty:
                 continue
             except Exception, ex:
                 self.log.error("Got exception '%r'" % ex)
-                 
+
+
+    def _push_sft(self, sft, after):
+        """ Puts SFT on heap with its first execution 
+            time at, or after, 'after' (datetime, UTC). 
+            SFTs that already got executed for that minute 
+            are scheduled for their following execution time. 
+        """
+        last = self.last_fired.get(sft.get_name())
+        if last and last >= after:
+            after = last + Scheduler.ONE_MINUTE
+
+        fire_time = sft.next_exec_time(after)
+        if not fire_time:
+            self.log.warn("SFT '%s' has no upcoming execution time." % sft.get_name())
+            return
+        heapq.heappush(self.sft_heap, 
+            (calendar.timegm(fire_time.timetuple()), self.sequence.next(), sft))
+
+
+    def _schedule_sfts(self, now):
+        """ (Re-)builds heap from the SFTs currently known 
+            by the housekeeper. 
+            now - time in seconds since epoch
+        """
+        self.sft_heap = []
+        _minute = datetime(*datetime.utcfromtimestamp(now).timetuple()[:5])
+        for sft in self.housekeeper.sfts:
+            self._push_sft(sft, _minute)
+        self.sft_generation = self.housekeeper.generation
+        self.log.debug("Scheduled %d SFTs." % len(self.sft_heap))
+
+
+    def _stage_due_sfts(self, now):
+        """ Moves all SFTs, whose execution time has come, to
+            the processing queue and re-schedules them. 
+            now - time in seconds since epoch
+        """
+        _minute = datetime(*datetime.utcfromtimestamp(now).timetuple()[:5])
+
+        while self.sft_heap and self.sft_heap[0][0] <= now:
+            fire_ts, _, sft = heapq.heappop(self.sft_heap)
+            self.log.debug("Staging SFT '%s' for execution." % sft.get_name())
+            self.procq.put((sft, time.time()))
+
+            fire_time = datetime.utcfromtimestamp(fire_ts)
+            self.last_fired[sft.get_name()] = fire_time
+            # don't catch up on minutes we missed
+            self._push_sft(sft, max(fire_time + Scheduler.ONE_MINUTE, _minute))
+
+
+    def __write_snapshots(self):
+        """ writes snapshots of latest SFT results. Failures
+            must not stop the scheduling of SFTs.
+        """
+        try:
+            self.snapshots.write()
+        except Exception, e:
+            self.log.error("Writing snapshots failed with %r" % e)
+
+
+    def __log_command_stats(self):
+        """ logs wall time statistics of the arc commands """
+        for name, st in sorted(helpers.get_executor().get_stats().items()):
+            self.log.info("'%s': %d calls (%d timed out), %.3f secs avg, %.3f secs max, %.3f secs last" % \
+                (name, st['calls'], st['timeouts'], st['total'] / max(st['calls'], 1), 
+                st['max'], st['last']))
+
 
     def start(self):
         """ starting scheduler """
@@ -54,38 +147,52 @@ class Scheduler(object):
             tr = Thread(target=self._run_sfts)
             tr.start()
 
+        next_cycle = time.time()
+        next_refresh = next_cycle + g.config.sft_refresh_interval
 
         while True:
             try:
                 timestamp = time.time()
-                self.housekeeper.main()
-        
-                # fetch results of previous SFTs and publish them
-                cycle -= 1
-                if cycle <= 1:
-                    self.publisher.main()
-                    cycle = Scheduler.CHECK_INTERVAL
+                if timestamp >= next_cycle:
+                    next_cycle = timestamp + Scheduler.CYCLE_TIME
+                    self.housekeeper.main()
+            
+                    # fetch results of previous SFTs and publish them. Due 
+                    # jobs get checked every cycle (see Publisher.poll)
+                    cycle -= 1
+                    if cycle <= 1:
+                        self.publisher.main()
+                        self.__write_snapshots()
+                        self.__log_command_stats()
+                        cycle = Scheduler.CHECK_INTERVAL
+                    else:
+                        self.publisher.poll()
+
+                    # notify nagios on stata 
+                    g.notifier.notify()
+
+                if time.time() >= next_refresh:
+                    next_refresh = time.time() + g.config.sft_refresh_interval
+                    self.housekeeper.refresh_sfts()
+
+                if self.sft_generation != self.housekeeper.generation:
+                    self._schedule_sfts(time.time())
 
                 # add  eligible SFTs to processing queue
-                for sft in self.housekeeper.sfts:
-                    self.log.debug("Checking SFT '%s' for execution." % sft.get_name())
-                    if sft.is_exec_time():
-                        self.log.debug("Staging SFT '%s' for execution." % sft.get_name())
-                        self.procq.put((sft, timestamp))
-
-                # notify nagios on stata 
-                g.notifier.notify()
-
-                # wait  before next turn
-                proctime = time.time() - timestamp
-                if proctime > Scheduler.CYCLE_TIME:
-                    continue
-                else:
-                    time.sleep(Scheduler.CYCLE_TIME - proctime)
+                self._stage_due_sfts(time.time())
+
+                # wait until next SFT is due, or next cycle/refresh starts
+                wakeup = min(next_cycle, next_refresh)
+                if self.sft_heap:
+                    wakeup = min(wakeup, self.sft_heap[0][0])
+                delay = wakeup - time.time()
+                if delay > 0:
+                    time.sleep(delay)
 
             except Exception, e:
                 self.log.error("Got execption %r", e)
-                time.sleep(Scheduler.CYCLE_TIME - proctime)
+                next_cycle = time.time() + Scheduler.CYCLE_TIME
+                time.sleep(1) # don't spin on persistent errors
                 
 
     def stop(self):
@@ -12,20 +12,29 @@ import logging
 import hashlib 
 import random
 import os
-from datetime import datetime
+from threading import Lock, currentThread
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
 
 import sft.db.sft_meta as meta
 import sft.db.sft_schema as schema
 import sft.sft_globals as g # import config, pxhandle, notifier
 
 from sft.errors.sft import SFTInvalidExecTime, SFTInvalidTestParams, SFTConfigError
+from sft.errors.cron import CronError
 from sft.nagios_notifier import NagiosNotification
 from sft.utils import helpers
+from sft.utils.cron import CronSchedule
+
+# db independent copies of the VOs (and their users), clusters 
+# and tests of a SFT
+SFTVO = namedtuple('SFTVO', 'name users')
+SFTUser = namedtuple('SFTUser', 'DN passwd')  # passwd is encrypted
+SFTCluster = namedtuple('SFTCluster', 'hostname')
+SFTTestSpec = namedtuple('SFTTestSpec', 'name xrsl')
 
-class AllMatch(set): 
-    """Universal set - match everything"""
-    def __contains__(self, item): 
-        return True
 
 class SFT_Event(object):
     """ Site Functional Test (SFT) Event. The class holds 
@@ -36,10 +45,13 @@ class SFT_Event(object):
     TIMEOUT = 20    # secs we wait for arc commands to complete
     
     def __init__(self, sft_name, minute=None, hour=None,
-                       day=None, month=None, dow=None):
+                       day=None, month=None, dow=None, sft=None):
         """
         sft_name - name of SFT 
-        minute, hour, day, month, dow (day of week) - date parameters
+        minute, hour, day, month, dow (day of week) - crontab style
+                date parameters (strings), None means '*'
+        sft - SFT test description object (see _populate_sft_details),
+              fetched from db if not set
 
         raises: 
             SFTInvalidExecTime if given date parameters are 
@@ -49,51 +61,24 @@ class SFT_Event(object):
         self.log = logging.getLogger(__name__)
         self.sft_name = sft_name
         self.arcsub = '/usr/bin/arcsub'
-        self.joblist = os.path.join(g.config.jobsdir, 'jobs.xml')
-        self.clusters_down = []
+        self.clusters_down = frozenset()
 
         self.vos = None
         self.clusters = None
         self.tests = None
 
-        allMatch = AllMatch()
-        
-        if not minute and minute != 0 :
-            minute = allMatch
-        if not hour and hour != 0:
-            hour = allMatch
-        if not day and day != 0:
-            day = allMatch
-        if not month and month != 0:
-            month = allMatch
-        if not dow and dow != 0:
-            dow = allMatch
-
         try:
-            self.mins = self._conv_to_set(minute)
-            self.hours = self._conv_to_set(hour)
-            self.days = self._conv_to_set(day)
-            self.months = self._conv_to_set(month)
-            self.dow = self._conv_to_set(dow)
-        except:
+            self.schedule = CronSchedule(minute, hour, day, month, dow)
+        except CronError, e:
             raise SFTInvalidExecTime('INVALID_EXEC_TIME',
-                "The execution times of the '%s' are invalid." % sft_name)
+                "The execution times of the '%s' are invalid: %s" % (sft_name, e.msg))
             
-        self._populate_sft_details()
+        self._populate_sft_details(sft)
         self._set_arcsub()
 
         self.log.debug("Initialization finished")
 
 
-    def _conv_to_set(self, obj):  
-        """ converstion to set """
-        if isinstance(obj, (int, long)):
-            return set([obj]) 
-        if not isinstance(obj, set):
-            obj = set(obj)
-        return obj
-    
-
     def _set_arcsub(self):
         """ Sets path of  arcsub command.
 
@@ -108,14 +93,20 @@ class SFT_Event(object):
                 "'%s' is not a valid file/path" % self.arcsub)
             
 
-    def _populate_sft_details(self):
+    def _populate_sft_details(self, sft = None):
         """ 
         Populates test structure of SFT, that is
         the involved  VOs, clusters and tests the SFT consists of. 
+        The structure is copied from the db objects, so events don't 
+        access the db anymore (e.g. from other threads). 
+
+        sft - SFT test description object (with its groups loaded, see 
+              helpers.get_sft_tests_snapshot()). Fetched from db if None.
 
         raises SFTInalidTestParams for any issue with the SFT test setup.
         """
-        sft = helpers.get_sft_test_details(self.sft_name)
+        if not sft:
+            sft = helpers.get_sft_test_details(self.sft_name)
         
         if not sft:
             self.log.warn("SFT test '%s' does not exist anymore." % \
@@ -123,32 +114,36 @@ class SFT_Event(object):
             raise SFTInvalidTestParams("SFT missing", 
                 'SFT test does not exist anymore.')
         else:
-            vosg = helpers.get_vo_group_details(sft.vo_group)
+            vosg = sft.vo_group_details
             if not vosg:
                 self.log.warn("SFT test '%s' has no VOs specified." % 
                     self.sft_name)
                 raise SFTInvalidTestParams("VO missing", 
                     'No VOs associated with SFT.')
             else:
-                self.vos = vosg.vos
+                self.vos = [SFTVO(vo.name, 
+                        [SFTUser(user.DN, user.passwd) for user in vo.users])
+                        for vo in vosg.vos]
 
-            clg = helpers.get_cluster_group_details(sft.cluster_group)
+            clg = sft.cluster_group_details
             if not clg:
                 self.log.warn("SFT test '%s' has no clusters specified." % \
                     self.sft_name)
                 raise SFTInvalidTestParams('Cluster missing',
                     'No Cluster associated with SFT.')
             else:   
-                self.clusters = clg.clusters
+                self.clusters = [SFTCluster(cluster.hostname) 
+                        for cluster in clg.clusters]
 
-            tsts = helpers.get_test_suit_details(sft.test_suit)
+            tsts = sft.test_suit_details
             if not tsts:
                 self.log.warn("SFT test '%s' has no tests specified." % \
                     self.sft_name)
                 raise SFTInvalidTestParams('Tests missing',
                     'No test jobs associated with SFT.')
             else:
-                self.tests = tsts.tests
+                self.tests = [SFTTestSpec(test.name, test.xrsl) 
+                        for test in tsts.tests]
         
     
     def is_exec_time(self, t = None):
@@ -160,11 +155,27 @@ class SFT_Event(object):
             t = datetime(*datetime.utcnow().timetuple()[:5])
 
         self.log.debug("Check whether time  matches")
-        return ((t.minute     in self.mins) and
-                (t.hour       in self.hours) and
-                (t.day        in self.days) and
-                (t.month      in self.months) and
-                (t.weekday()  in self.dow))
+        return self.schedule.matches(t)
+
+
+    def next_exec_time(self, t = None):
+        """Returns the first datetime (minute resolution) at, or
+            after, t at which this event is to be triggered. Returns 
+            None if the event never gets triggered.
+            t - datetime object, using 'now' if not set"""
+
+        if not t:
+            t = datetime.utcnow()
+        t = datetime(*t.timetuple()[:5])
+        return self.schedule.next_after(t - timedelta(minutes = 1))
+
+
+    def next_exec_times(self, n, t = None):
+        """Returns list with the next n execution times after t. 
+            t - datetime object, using 'now' if not set"""
+        if not t:
+            t = datetime.utcnow()
+        return self.schedule.next_times(t, n)
 
 
     def _verify_all_sft_users(self):
@@ -183,7 +194,7 @@ class SFT_Event(object):
             for user in vo.users:
                 _no_err_flg = True
                 DN = user.DN
-                passwd = user.get_passwd()
+                passwd = schema.decrypt_passwd(user.passwd)
                 file_prefix = hashlib.md5(DN).hexdigest()
 
                 myproxy_file = os.path.join(g.config.proxy_dir,
@@ -229,121 +240,295 @@ class SFT_Event(object):
         return self.sft_name
 
     def set_clusters_down(self, clusters):
-        """ Sets the list of clusters that are currently
+        """ Sets the set of clusters that are currently
             on scheduled downtime. 
         """
         self.clusters_down = clusters
 
 
-    def run(self):
-        """ run SFT test """
-        self.log.debug("Running SFT.") 
-        session = meta.Session
+    def get_submissions(self, queued = None):
+        """ Splits a run of the SFT into its individual job submissions, 
+            i.e. one submission per (VO, cluster, test) triple.  
+            Clusters on scheduled downtime are skipped. The submissions
+            store their jobs in the db in batches of 'db_batch_size'.
+
+            queued - epoch the SFT run got queued at, kept by the 
+                     submissions, so their queue waiting time covers 
+                     the whole time since then
+            returns list of SFTSubmission objects
+        """
         _vo_dict = self._verify_all_sft_users()
         self.log.debug("got _vo_dict '%r'" % _vo_dict)
 
-        _commit_flg = False
+        batch = SubmissionBatch(self.sft_name, 0, g.config.db_batch_size)
+        submissions = []
         for vo_name in _vo_dict.keys():
             DN, voms_proxy_file  = random.choice(_vo_dict[vo_name]) # random select one user
-            os.environ['X509_USER_PROXY'] = voms_proxy_file
-
             for cluster in self.clusters:
                 if cluster.hostname in self.clusters_down:
                     continue
                 for test in self.tests:
-                    sft_job = schema.SFTJob(self.sft_name)
-                    sft_job.cluster_name = cluster.hostname
-                    sft_job.DN = DN
-                    sft_job.vo_name = vo_name
-                    sft_job.test_name = test.name
-
-                    xrsl_str = test.xrsl.replace('\n',' ')
-                    cmd = "%s -j %s -c %s -e '%s'" % \
-                        (self.arcsub, self.joblist, cluster.hostname, xrsl_str)
-                    try:
-                        output, stderr, return_code  = helpers.timeout_call(cmd, SFT_Event.TIMEOUT)
-                    except helpers.Alarm:
-                        self.log.error('Arcsub timed out after (%d secs) for %s.' % (SFT_Event.TIMEOUT, cluster.hostname))
-                        sft_job.status = 'failed'
-                        sft_job.error_msg = 'Arcsub timed out after (%d secs)' % SFT_Event.TIMEOUT
-                        sft_job.error_type = "arcsub"
-                        session.add(sft_job)
-                        session.flush()
-                        _commit_flg = True
-
-                        _notification = NagiosNotification(cluster.hostname, self.sft_name )
-                        _msg =  'Arcsub timed out after (%d secs)' % SFT_Event.TIMEOUT
-                        _notification.set_message(_msg)
-                        _notification.set_status('CRITICAL')
-                        g.notifier.add_notification(_notification)
-                        break
-                    
-                    if return_code == 0:
-                        # additional check -> if cluster does not exists, we still get returncode 0
-                        if 'Job submission failed due to' in output:    
-                            self.log.error("(%s, %s) - job submission failed (retcode is 0)" % \
-                                (test.name, sft_job.cluster_name))
-                            sft_job.status = 'failed'
-                            sft_job.error_msg = output
-                            sft_job.error_type = "arcsub"
-                            session.add(sft_job)
-                            session.flush()
-                            _commit_flg = True
-
-                            _notification = NagiosNotification(cluster.hostname, self.sft_name )
-                            _msg = output # XXX maybe add VO + DN + test to get more details
-                            _notification.set_message(_msg)
-                            _notification.set_status('CRITICAL')
-                            g.notifier.add_notification(_notification)
-                            continue
-                        else: 
-                            jobid = output.split('jobid:')[1].strip()
-                            sft_job.jobid = jobid
-                            self.log.debug("(%s)- job sumbitted: ID %s" % (test.name, jobid))
-                            sft_job.status = 'submitted'
-                            session.add(sft_job)
-                            session.flush()
-                            _commit_flg = True
-
-                            _notification = NagiosNotification(cluster.hostname, self.sft_name )
-                            _msg = '(%s) - successfully submitted' % (test.name)
-                            _notification.set_message(_msg)
-                            _notification.set_status('OK')
-                            g.notifier.add_notification(_notification)
-                            continue
-                    # hack to intercept spurious 'Certificate/Proxy path is empty' error
-                    elif 'Job submitted with jobid:' in output:
-                        jobid = output.split('jobid:')[1].strip()
-                        sft_job.jobid = jobid
-                        self.log.debug("(%s)- job sumbitted: ID %s" % (test.name, jobid))
-                        sft_job.status = 'submitted'
-                        session.add(sft_job)
-                        session.flush()
-                        _commit_flg = True
-
-                        _notification = NagiosNotification(cluster.hostname, self.sft_name )
-                        _msg = '(%s) - successfully submitted' % (test.name)
-                        _notification.set_message(_msg)
-                        _notification.set_status('OK')
-                        g.notifier.add_notification(_notification)
-                        continue
-                    else:
-                        self.log.error("(%s) Job submission failed, with: %s" % (test.name, stderr))
-                        sft_job.error_type = "arcsub"
-                        if output and SFT_Event.SPURIOUS_ARC_ERROR in stderr:
-                            sft_job.error_msg =  output
-                        else:
-                            sft_job.error_msg =  stderr 
-                        sft_job.status = 'failed'
-                        session.add(sft_job)
-                        session.flush()
-                        _commit_flg = True
-
-                        _notification = NagiosNotification(cluster.hostname, self.sft_name )
-                        _msg = '(%s) - %s' % (test.name, stderr)
-                        _notification.set_message(_msg)
-                        _notification.set_status('CRITICAL')
-                        g.notifier.add_notification(_notification)
-                        
-        if _commit_flg:
+                    submissions.append(SFTSubmission(self.sft_name, 
+                        self.arcsub, vo_name, DN, voms_proxy_file,
+                        cluster.hostname, test.name, test.xrsl, batch))
+                    submissions[-1].queued = queued
+        batch.outstanding = len(submissions)
+        return submissions
+
+
+    def run(self):
+        """ run SFT test, i.e. all of its submissions one after the other """
+        self.log.debug("Running SFT.") 
+        for submission in self.get_submissions():
+            submission.run()
+
+
+class SubmissionBatch(object):
+    """ Collects the sft_job rows of the submissions of a SFT run and 
+        writes them with bulk inserts of up to batch_size rows. Every 
+        bulk insert is committed on its own. Rows are added by the 
+        (parallel) submissions, the last one writes what is left. 
+    """
+
+    def __init__(self, sft_name, expected, batch_size):
+        """
+        sft_name - name of SFT
+        expected - number of submissions (rows) of SFT run
+        batch_size - max number of rows per bulk insert
+        """
+        self.log = logging.getLogger(__name__)
+        self.sft_name = sft_name
+        self.outstanding = expected
+        self.batch_size = max(1, batch_size)
+        self.pending = []
+        self.timed_out = set() # (VO, cluster) tupples arcsub timed out for
+        self.lock = Lock()
+
+    def set_timed_out(self, vo_name, cluster_name):
+        """ records that arcsub timed out for cluster on behalf of VO. """
+        self.lock.acquire()
+        try:
+            self.timed_out.add((vo_name, cluster_name))
+        finally:
+            self.lock.release()
+
+    def has_timed_out(self, vo_name, cluster_name):
+        """ returns True if arcsub timed out for cluster on behalf of VO """
+        self.lock.acquire()
+        try:
+            return (vo_name, cluster_name) in self.timed_out
+        finally:
+            self.lock.release()
+
+    def skip(self):
+        """ records a submission that has been skipped (no row). """
+        self.add(None)
+
+    def add(self, row):
+        """ adds row (dictionary with sft_job columns) to batch. Writes 
+            batch if it's full or if all submissions are done. 
+            row - None for skipped submissions
+        """
+        rows = None
+        self.lock.acquire()
+        try:
+            if row:
+                self.pending.append(row)
+            self.outstanding -= 1
+            if len(self.pending) >= self.batch_size or self.outstanding <= 0:
+                rows = self.pending
+                self.pending = []
+        finally:
+            self.lock.release()
+
+        if rows:
+            self.write(rows)
+
+    def __read_ids(self, session, rows):
+        """ sets the 'id' of the rows, as a bulk insert doesn't return 
+            the ids of the inserted rows. Rows are identified by cluster, 
+            VO, test and submission time (there is at most one 
+            submission per SFT and minute).
+        """
+        t_job = schema.t_sft_job
+        ids = {}  # (cluster, VO, test, submission time) -> id
+        for row in session.execute(sa.select([t_job.c.id, t_job.c.cluster_name, 
+                t_job.c.vo_name, t_job.c.test_name, t_job.c.submissiontime]).\
+                where(sa.and_(t_job.c.sft_test_name == self.sft_name, 
+                    t_job.c.submissiontime.in_(
+                        list(set([_row['submissiontime'] for _row in rows])))))).fetchall():
+            ids[(row['cluster_name'], row['vo_name'], row['test_name'], 
+                row['submissiontime'])] = row['id']
+        for row in rows:
+            row['id'] = ids.get((row['cluster_name'], row['vo_name'], 
+                row['test_name'], row['submissiontime']))
+
+    def write(self, rows):
+        """ inserts rows with one bulk insert and commits. """
+        session = meta.Session
+        try:
+            session.execute(schema.t_sft_job.insert(), rows)
+            self.__read_ids(session, rows)
+            helpers.update_latest_results(session, rows)
+            helpers.log_job_transitions(session, rows)
             session.commit()
+            self.log.debug("Stored %d jobs of SFT '%s'." % (len(rows), self.sft_name))
+        except Exception, e:
+            session.rollback()
+            self.log.error("Storing %d jobs of SFT '%s' failed with %r" % \
+                (len(rows), self.sft_name, e))
+
+
+class SFTSubmission(object):
+    """ Submission of a single job of a SFT run, i.e. of one 
+        test to one cluster on behalf of one VO. Submissions can be 
+        run in parallel, as every thread stores the jobs it submits in 
+        its own job lists (see helpers.get_joblist). Once arcsub timed 
+        out for a cluster, the remaining submissions of the SFT run for 
+        the cluster (and VO) are skipped.
+    """
+    
+    def __init__(self, sft_name, arcsub, vo_name, DN, 
+                        voms_proxy_file, cluster_name, test_name, xrsl, 
+                        batch = None):
+        """
+        sft_name - name of SFT the job belongs to
+        arcsub - path of arcsub command
+        vo_name, DN, voms_proxy_file - VO, user and voms proxy 
+                   of user to submit the job with
+        cluster_name - hostname of cluster to submit the job to
+        test_name, xrsl - name and XRSL of test
+        batch - SubmissionBatch the job gets stored with, if None 
+                the job gets stored on its own
+        """
+        self.log = logging.getLogger(__name__)
+        self.sft_name = sft_name
+        self.arcsub = arcsub
+        self.vo_name = vo_name
+        self.DN = DN
+        self.voms_proxy_file = voms_proxy_file
+        self.cluster_name = cluster_name
+        self.test_name = test_name
+        self.xrsl = xrsl
+        self.batch = batch
+        self.queued = None # epoch the SFT run was queued at (set by get_submissions)
+        self.queue_wait = None # secs submission waited for being run (set by scheduler)
+        self.arcsub_time = None # secs arcsub took
+
+    def get_name(self):
+        """ returns name of submission """
+        return '%s (%s, %s, %s)' % (self.sft_name, self.vo_name,
+                self.cluster_name, self.test_name)
+
+    def _notify(self, status, msg):
+        """ adds notification for cluster of submission, with
+            the arcsub and queue waiting times as performance data.
+        """ 
+        _notification = NagiosNotification(self.cluster_name, self.sft_name)
+        _notification.set_message(msg)
+        _notification.set_status(status)
+        if self.arcsub_time is not None:
+            _notification.add_perf_data('arcsub', self.arcsub_time, 's')
+        if self.queue_wait is not None:
+            _notification.add_perf_data('queue_wait', self.queue_wait, 's')
+        g.notifier.add_notification(_notification)
+
+    def _submit(self, sft_job):
+        """ submits job and sets status, jobid, job list and errors 
+            of sft_job (dictionary with sft_job columns). 
+
+            returns False if job didn't get submitted, as arcsub
+                already timed out for the cluster in this SFT run.
+        """
+        if self.batch and self.batch.has_timed_out(self.vo_name, self.cluster_name):
+            return False
+
+        joblist = helpers.get_joblist(self.cluster_name, currentThread().getName())
+        sft_job['joblist'] = joblist
+        xrsl_str = self.xrsl.replace('\n',' ')
+        cmd = "%s -j %s -c %s -e '%s'" % \
+            (self.arcsub, joblist, self.cluster_name, xrsl_str)
+        lock = helpers.get_joblist_lock(joblist) # only contended by publisher
+        lock.acquire()
+        try:
+            try:
+                output, stderr, return_code, self.arcsub_time  = helpers.get_executor().\
+                        execute(cmd, SFT_Event.TIMEOUT, x509_user_proxy = self.voms_proxy_file)
+            except helpers.Alarm:
+                output = None
+                if self.batch:
+                    self.batch.set_timed_out(self.vo_name, self.cluster_name)
+        finally:
+            lock.release()
+
+        if output is None:
+            self.arcsub_time = float(SFT_Event.TIMEOUT)
+            self.log.error('Arcsub timed out after (%d secs) for %s.' % \
+                (SFT_Event.TIMEOUT, self.cluster_name))
+            sft_job['status'] = 'failed'
+            sft_job['error_msg'] = 'Arcsub timed out after (%d secs)' % SFT_Event.TIMEOUT
+            sft_job['error_type'] = "arcsub"
+            self._notify('CRITICAL', 'Arcsub timed out after (%d secs)' % SFT_Event.TIMEOUT)
+            return True
+
+        # if cluster does not exists, we still get returncode 0
+        if return_code == 0 and 'Job submission failed due to' in output:
+            self.log.error("(%s, %s) - job submission failed (retcode is 0)" % \
+                (self.test_name, self.cluster_name))
+            sft_job['status'] = 'failed'
+            sft_job['error_msg'] = output
+            sft_job['error_type'] = "arcsub"
+            self._notify('CRITICAL', output) # XXX maybe add VO + DN + test to get more details
+        # hack to intercept spurious 'Certificate/Proxy path is empty' error
+        elif (return_code == 0 or 'Job submitted with jobid:' in output) and \
+                'jobid:' in output:
+            jobid = output.split('jobid:')[1].strip()
+            sft_job['jobid'] = jobid
+            self.log.debug("(%s)- job sumbitted: ID %s" % (self.test_name, jobid))
+            sft_job['status'] = 'submitted'
+            self._notify('OK', '(%s) - successfully submitted' % (self.test_name))
+        else:
+            self.log.error("(%s) Job submission failed, with: %s" % (self.test_name, stderr))
+            sft_job['error_type'] = "arcsub"
+            if output and SFT_Event.SPURIOUS_ARC_ERROR in stderr:
+                sft_job['error_msg'] =  output
+            else:
+                sft_job['error_msg'] =  stderr 
+            sft_job['status'] = 'failed'
+            self._notify('CRITICAL', '(%s) - %s' % (self.test_name, stderr))
+        return True
+
+    def run(self):
+        """ submits job and records its state in db (see SubmissionBatch) """
+        now = datetime.utcnow().replace(microsecond = 0) # as stored by db
+        sft_job = dict(sft_test_name = self.sft_name,
+                cluster_name = self.cluster_name,
+                DN = self.DN,
+                vo_name = self.vo_name,
+                test_name = self.test_name,
+                jobid = None,
+                joblist = None,
+                status = None,
+                error_type = None,
+                error_msg = None,
+                submissiontime = now,
+                db_lastmodified = now)
+        try:
+            if not self._submit(sft_job):
+                self.log.info("Skipped %s, as arcsub timed out for cluster." % \
+                    self.get_name())
+                if self.batch:
+                    self.batch.skip()
+                return
+        except Exception, e:
+            self.log.error("(%s) Job submission failed, with: %r" % (self.test_name, e))
+            sft_job['status'] = 'failed'
+            sft_job['error_type'] = "arcsub"
+            sft_job['error_msg'] = repr(e)
+
+        sft_job['is_active'] = schema.is_active_status(sft_job['status'])
+
+        batch = self.batch
+        if not batch:
+            batch = SubmissionBatch(self.sft_name, 1, 1)
+        batch.add(sft_job)
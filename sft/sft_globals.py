@@ -3,7 +3,7 @@
     included here but in the sft.db.sft_meta.py file.
 """
 
-__all__ = ['config', 'notifier', 'pxhandle']
+__all__ = ['config', 'notifier', 'pxhandle', 'executor']
 
 # configuration object, must explicitly initialized in __init__.py
 config = None
@@ -15,5 +15,8 @@ notifier = None
 
 pxhandle = None
 
+# executor of (arc) client commands, shared by all threads
+executor = None
+
 
 
@@ -0,0 +1,164 @@
+"""
+JSON snapshots of the latest SFT results, for the GridMonitor
+(or any other web front-end) to be served as static files.
+
+The snapshots are written to the 'snapshots' directory below
+url_root:
+    . index.json - names of clusters and SFTs and their snapshot files
+    . cluster/<cluster>.json - latest results of a cluster
+    . sft/<sft>.json - latest results of an SFT
+Files are replaced atomically (rename), and only if their
+content changed. Optionally a gzip compressed copy (.json.gz)
+is written next to every snapshot. Snapshots of clusters and
+SFTs without results anymore get removed.
+"""
+__author__ = "Placi Flury grid@switch.ch"
+__date__ = "18.10.2026"
+__version__ = "0.1.0"
+
+import os
+import os.path
+import re
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+
+import sft.db.sft_meta as meta
+import sft.db.sft_schema as schema
+
+
+class SnapshotWriter(object):
+    """ Writes JSON snapshots of the latest SFT results
+        (see sft_latest_result table).
+    """
+
+    SUBDIR = 'snapshots'
+    RESULT_ATTRS = ['sft_test_name', 'cluster_name', 'vo_name', 'test_name',
+            'status', 'jobid', 'error_type', 'error_msg', 'outputdir',
+            'submissiontime', 'db_lastmodified']
+
+    def __init__(self, url_root, compress = False):
+        """ url_root - directory below which snapshots are written
+            compress - if True, gzip compressed copies get written as well
+        """
+        self.log = logging.getLogger(__name__)
+        self.root = os.path.join(url_root, SnapshotWriter.SUBDIR)
+        self.compress = compress
+        self.digests = {} # path -> md5 of last written content
+        for subdir in ('cluster', 'sft'):
+            path = os.path.join(self.root, subdir)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    @staticmethod
+    def file_name(name):
+        """ returns name of snapshot file for cluster or SFT name. 
+            Characters other than letters, digits, '.' and '-' (as 
+            well as a leading '.') are escaped as '_<hex>' per (UTF-8)
+            byte, so different names get different files.
+        """
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        _name = re.sub(r'[^A-Za-z0-9.-]|^\.', 
+                lambda m: '_%02x' % ord(m.group(0)), name)
+        return _name + '.json'
+
+    def __result(self, result):
+        """ returns dictionary of LatestResult object """
+        _dict = {}
+        for attr in SnapshotWriter.RESULT_ATTRS:
+            value = getattr(result, attr)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            _dict[attr] = value
+        return _dict
+
+    def __write(self, relpath, data):
+        """ writes data as JSON to relpath (below snapshot root) by
+            replacing the file atomically, unless its content
+            did not change.
+        """
+        content = json.dumps(data, sort_keys = True, indent = 1)
+        digest = hashlib.md5(content).hexdigest()
+        if self.digests.get(relpath) == digest:
+            return
+        path = os.path.join(self.root, relpath)
+        directory = os.path.dirname(path)
+
+        fd, tmp = tempfile.mkstemp(dir = directory, prefix = '.snapshot')
+        try:
+            try:
+                os.write(fd, content)
+            finally:
+                os.close(fd)
+            os.chmod(tmp, 0644)
+            os.rename(tmp, path)
+            if self.compress:
+                fd, tmp = tempfile.mkstemp(dir = directory, prefix = '.snapshot')
+                os.close(fd)
+                zfile = gzip.open(tmp, 'wb')
+                try:
+                    zfile.write(content)
+                finally:
+                    zfile.close()
+                os.chmod(tmp, 0644)
+                os.rename(tmp, path + '.gz')
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.digests[relpath] = digest
+
+    def __remove_stale(self, written):
+        """ removes snapshots of clusters and SFTs that were not 
+            written by the current pass. 
+            written - relpaths of the snapshots of the current pass
+        """
+        for subdir in ('cluster', 'sft'):
+            for name in os.listdir(os.path.join(self.root, subdir)):
+                relpath = os.path.join(subdir, name)
+                if relpath.endswith('.json.gz'):
+                    relpath = relpath[:-len('.gz')]
+                elif not relpath.endswith('.json'):
+                    continue
+                if relpath in written:
+                    continue
+                try:
+                    os.remove(os.path.join(self.root, subdir, name))
+                except OSError, e:
+                    self.log.warn("Removing snapshot '%s' failed: %r" % (name, e))
+                self.digests.pop(relpath, None)
+
+    def write(self):
+        """ writes snapshots of the latest SFT results """
+        clusters = {}   # cluster -> list of results
+        sfts = {}       # SFT -> list of results
+        for result in meta.Session.query(schema.LatestResult).\
+                order_by(schema.LatestResult.sft_test_name,
+                    schema.LatestResult.cluster_name,
+                    schema.LatestResult.vo_name,
+                    schema.LatestResult.test_name):
+            _result = self.__result(result)
+            clusters.setdefault(result.cluster_name, []).append(_result)
+            sfts.setdefault(result.sft_test_name, []).append(_result)
+        meta.Session.commit() # end transaction, to see later changes
+
+        index = dict(clusters = {}, sfts = {})
+        written = set()
+        for cluster, results in clusters.items():
+            relpath = os.path.join('cluster', SnapshotWriter.file_name(cluster))
+            index['clusters'][cluster] = relpath
+            self.__write(relpath, dict(cluster = cluster, results = results))
+            written.add(relpath)
+        for sft, results in sfts.items():
+            relpath = os.path.join('sft', SnapshotWriter.file_name(sft))
+            index['sfts'][sft] = relpath
+            self.__write(relpath, dict(sft = sft, results = results))
+            written.add(relpath)
+        self.__write('index.json', index)
+        self.__remove_stale(written)
+
+        self.log.debug("Wrote snapshots of %d clusters and %d SFTs." % \
+            (len(clusters), len(sfts)))
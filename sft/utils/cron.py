@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Compiled crontab style schedules.
+
+Every field of a crontab entry gets compiled into an integer
+bitmask (bit n set -> value n matches), which makes matching
+a given time a handful of bit operations and allows to compute
+the next execution time(s) without scanning minute by minute.
+
+Supported syntax per field (see crontab(5)):
+    - '*', single values, ranges '1-5', lists '1,2,8-12'
+    - steps on any range or wildcard, e.g. '*/15', '1-30/2', '5/10'
+    - names for months ('jan'-'dec') and days of week ('mon'-'sun')
+
+Unlike crontab(5), and as SFT execution times always have been
+interpreted:
+    - days of week are numbered as by datetime.weekday(), i.e.
+      Monday=0 to Sunday=6 (7 is Sunday as well)
+    - a day must match both the day of month and the day of week
+"""
+__author__ = "Placi Flury grid@switch.ch"
+__date__ = "18.10.2026"
+__version__ = "0.1.0"
+
+import calendar
+from datetime import datetime, timedelta
+
+from sft.errors.cron import CronRangeError, CronSyntaxError
+
+MONTH_NAMES = {'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+        'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12}
+
+DOW_NAMES = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4,
+        'sat': 5, 'sun': 6}
+
+# field name -> (min, max, names)
+FIELDS = {'minute': (0, 59, None),
+        'hour': (0, 23, None),
+        'day': (1, 31, None),
+        'month': (1, 12, MONTH_NAMES),
+        'dow': (0, 7, DOW_NAMES)}
+
+
+def _to_int(value, names, cron_str):
+    """ converts single field value (number or name) to integer """
+    value = value.strip().lower()
+    if value.isdigit():
+        return int(value)
+    if names and names.has_key(value):
+        return names[value]
+    raise CronSyntaxError("Syntax Error",
+        "'%s' in '%s' is not a valid value." % (value, cron_str))
+
+
+def compile_field(cron_str, _min, _max, names=None):
+    """
+    Compiles a single crontab field into a bitmask.
+    input: cron_str - crontab field as string
+           _min, _max - valid (inclusive) range of values
+           names - optional dictionary mapping names to values
+    returns: integer bitmask
+
+    raises: CronRangeError - for values outside of [_min, _max]
+            CronSyntaxError - for syntax errors
+    """
+    if cron_str is None:
+        cron_str = '*'
+    cron_str = str(cron_str).strip()
+    if not cron_str:
+        cron_str = '*'
+
+    mask = 0
+    for item in cron_str.split(','):
+        if '/' in item:
+            rng, step = item.split('/', 1)
+            if not step.strip().isdigit() or int(step) == 0:
+                raise CronSyntaxError("Syntax Error",
+                    "Step '%s' in '%s' must be a positive integer." % (step, cron_str))
+            step = int(step)
+            has_step = True
+        else:
+            rng, step = item, 1
+            has_step = False
+
+        rng = rng.strip()
+        if rng == '*':
+            start, end = _min, _max
+        elif '-' in rng:
+            start, end = rng.split('-', 1)
+            start = _to_int(start, names, cron_str)
+            end = _to_int(end, names, cron_str)
+        else:
+            start = _to_int(rng, names, cron_str)
+            # 'n/step' means starting at n up to max
+            if has_step:
+                end = _max
+            else:
+                end = start
+
+        if start < _min or end > _max:
+            raise CronRangeError("Range Error",
+                "'%s' in '%s' exceeds valid range %d-%d." % (item, cron_str, _min, _max))
+        if start > end:
+            raise CronRangeError("Range Error",
+                "'%s' in '%s' is an empty range." % (item, cron_str))
+
+        for v in xrange(start, end + 1, step):
+            mask |= 1 << v
+    return mask
+
+
+def mask_values(mask):
+    """ returns sorted list of values that are set in bitmask """
+    values = []
+    v = 0
+    while mask:
+        if mask & 1:
+            values.append(v)
+        mask >>= 1
+        v += 1
+    return values
+
+
+def _next_bit(mask, start):
+    """ returns smallest value >= start that is set in mask, or None """
+    m = mask >> start
+    if not m:
+        return None
+    return start + (m & -m).bit_length() - 1
+
+
+class CronSchedule(object):
+    """ A compiled crontab entry (minute, hour, day, month, day of week).
+        Times are naive datetime objects, which are interpreted in
+        whatever timezone the caller is using (SFTs use UTC).
+
+        A day matches if both its day of month and its day of week
+        (Monday=0) match.
+    """
+
+    MAX_YEARS = 9  # Feb 29 may be up to 8 years apart
+
+    def __init__(self, minute='*', hour='*', day='*', month='*', dow='*'):
+        """
+        raises: CronRangeError, CronSyntaxError for invalid entries
+        """
+        _fields = []
+        for f in (minute, hour, day, month, dow):
+            if f is None or not str(f).strip():
+                f = '*'
+            _fields.append(str(f).strip())
+        self.entry = ' '.join(_fields)
+
+        self.minutes = compile_field(minute, *FIELDS['minute'])
+        self.hours = compile_field(hour, *FIELDS['hour'])
+        self.days = compile_field(day, *FIELDS['day'])
+        self.months = compile_field(month, *FIELDS['month'])
+        dows = compile_field(dow, *FIELDS['dow'])
+        if dows & (1 << 7):  # 7 is Sunday as well
+            dows = (dows | (1 << 6)) & ~(1 << 7)
+        self.dows = dows
+
+    def __str__(self):
+        return self.entry
+
+    def __repr__(self):
+        return "CronSchedule('%s')" % self.entry
+
+    def _day_matches(self, t):
+        """ checks day of month and day of week of datetime t """
+        return bool((self.days & (1 << t.day)) and
+                (self.dows & (1 << t.weekday())))
+
+    def matches(self, t):
+        """ returns True if schedule fires at datetime t (minute resolution)"""
+        return bool((self.minutes & (1 << t.minute)) and
+                (self.hours & (1 << t.hour)) and
+                (self.months & (1 << t.month)) and
+                self._day_matches(t))
+
+    def next_after(self, t):
+        """ returns first datetime strictly after t at which the
+            schedule fires, or None if there is none (e.g. '30 feb').
+        """
+        t = datetime(*t.timetuple()[:5]) + timedelta(minutes=1)
+        last_year = t.year + CronSchedule.MAX_YEARS
+
+        while t.year <= last_year:
+            month = _next_bit(self.months, t.month)
+            if month is None:
+                t = datetime(t.year + 1, 1, 1)
+                continue
+            if month != t.month:
+                t = datetime(t.year, month, 1)
+                continue
+
+            if not self._day_matches(t):
+                days_in_month = calendar.monthrange(t.year, t.month)[1]
+                if t.day == days_in_month:
+                    if t.month == 12:
+                        t = datetime(t.year + 1, 1, 1)
+                    else:
+                        t = datetime(t.year, t.month + 1, 1)
+                else:
+                    t = datetime(t.year, t.month, t.day + 1)
+                continue
+
+            hour = _next_bit(self.hours, t.hour)
+            if hour is None:
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+                continue
+            if hour != t.hour:
+                t = datetime(t.year, t.month, t.day, hour)
+
+            minute = _next_bit(self.minutes, t.minute)
+            if minute is None:
+                t = datetime(t.year, t.month, t.day, t.hour) + timedelta(hours=1)
+                continue
+            return t.replace(minute=minute)
+
+        return None
+
+    def next_times(self, t, n):
+        """ returns list with (up to) next n execution times after t """
+        times = []
+        while len(times) < n:
+            t = self.next_after(t)
+            if not t:
+                break
+            times.append(t)
+        return times
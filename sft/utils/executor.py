@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Executor for (arc) client commands.
+
+Commands are started in their own session (and process group) by
+setsid(1), or by os.setsid() if there is no setsid command. The executor waits on the output pipes and the exit of
+the command at the same time (select.poll), hence a command returns
+as soon as it is done and large outputs can't block the command. On timeout the whole
+process group gets killed. The wall time of every command is
+recorded per command name.
+"""
+__author__ = "Placi Flury grid@switch.ch"
+__date__ = "18.10.2026"
+__version__ = "0.1.0"
+
+import os
+import os.path
+import errno
+import signal
+import select
+import subprocess
+import logging
+import time
+from threading import Lock
+
+
+class Alarm(Exception):
+    """ Raised if command did not complete within its timeout """
+    pass
+
+
+def get_call_env(env = None, x509_user_proxy = None):
+    """ returns environment for a subprocess. 
+        env - environment (dictionary) to start from, copy of 
+              process environment if not set
+        x509_user_proxy - proxy credential of the subprocess. Set
+              as X509_USER_PROXY in returned environment, if given.
+
+        Notice, the process environment (os.environ) is never modified, 
+        so concurrent calls with different credentials don't interfere.
+    """
+    if env is None:
+        env = os.environ
+    call_env = dict(env)
+    if x509_user_proxy:
+        call_env['X509_USER_PROXY'] = x509_user_proxy
+    return call_env
+
+
+def find_command(name, path = None):
+    """ returns full path of executable name, searched in path 
+        (defaults to PATH of process, plus /usr/bin and /bin), 
+        or None if there is no such executable.
+    """
+    if path is None:
+        path = os.environ.get('PATH', '') + os.pathsep + '/usr/bin:/bin'
+    for directory in path.split(os.pathsep):
+        if not directory:
+            continue
+        cmd = os.path.join(directory, name)
+        if os.path.isfile(cmd) and os.access(cmd, os.X_OK):
+            return cmd
+    return None
+
+
+class Executor(object):
+    """ Runs shell commands with a timeout and keeps per
+        command wall time statistics. Can be shared by threads.
+    """
+
+    READ_SIZE = 65536
+    REAP_INTERVAL = 0.005   # secs, polling interval once pipes are closed
+
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self.lock = Lock()
+        self.stats = {}  # command name -> dict with calls, timeouts, total, max, last
+        self.setsid = find_command('setsid')  # runs command in a new session
+        if not self.setsid:
+            self.log.warn("No 'setsid' command found, falling back to os.setsid().")
+
+    def _record(self, name, wall_time, timed_out):
+        """ records wall time of command with given name """
+        self.lock.acquire()
+        try:
+            if not self.stats.has_key(name):
+                self.stats[name] = dict(calls = 0, timeouts = 0,
+                        total = 0.0, max = 0.0, last = 0.0)
+            st = self.stats[name]
+            st['calls'] += 1
+            st['total'] += wall_time
+            st['last'] = wall_time
+            if wall_time > st['max']:
+                st['max'] = wall_time
+            if timed_out:
+                st['timeouts'] += 1
+        finally:
+            self.lock.release()
+
+    def get_stats(self):
+        """ returns copy of wall time statistics, i.e. a dictionary
+            command name -> dict(calls, timeouts, total, max, last)
+        """
+        self.lock.acquire()
+        try:
+            return dict([(k, v.copy()) for k, v in self.stats.items()])
+        finally:
+            self.lock.release()
+
+    def _kill(self, call):
+        """ kills process group of call """
+        try:
+            os.killpg(call.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        call.wait()
+
+    def execute(self, cmd, timeout, env = None, x509_user_proxy = None):
+        """ Invokes shell command cmd.
+            cmd - command string (passed to shell)
+            timeout - secs the command may take
+            env, x509_user_proxy - environment and proxy credential of the 
+                command (see get_call_env)
+
+            returns tupple (stdout, stderr, return code, wall time [secs])
+            raises Alarm if command did not complete within timeout
+        """
+        name = os.path.basename(cmd.split(' ', 1)[0])
+        start = time.time()
+        deadline = start + timeout
+
+        # started in its own session by setsid(1) rather than by a
+        # preexec_fn, which isn't safe in a process with threads
+        if self.setsid:
+            args, preexec_fn = [self.setsid, '/bin/sh', '-c', cmd], None
+        else:
+            args, preexec_fn = ['/bin/sh', '-c', cmd], os.setsid
+        call = subprocess.Popen(args,
+                close_fds = True,
+                env = get_call_env(env, x509_user_proxy),
+                preexec_fn = preexec_fn,
+                stdout = subprocess.PIPE,
+                stderr = subprocess.PIPE)
+
+        out_fd, err_fd = call.stdout.fileno(), call.stderr.fileno()
+        output = {out_fd: [], err_fd: []}
+        poller = select.poll()
+        for fd in output.keys():
+            poller.register(fd, select.POLLIN | select.POLLPRI | select.POLLHUP)
+        open_fds = set(output.keys())
+
+        try:
+            while open_fds:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Alarm
+                try:
+                    events = poller.poll(remaining * 1000)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd, _ in events:
+                    data = os.read(fd, Executor.READ_SIZE)
+                    if data:
+                        output[fd].append(data)
+                    else:
+                        poller.unregister(fd)
+                        open_fds.discard(fd)
+
+            # all output read, command is about to exit
+            while call.poll() is None:
+                if time.time() >= deadline:
+                    raise Alarm
+                time.sleep(Executor.REAP_INTERVAL)
+        except Alarm:
+            self._kill(call)
+            wall_time = time.time() - start
+            self._record(name, wall_time, True)
+            self.log.debug("'%s' killed after %.3f secs." % (name, wall_time))
+            raise
+        finally:
+            call.stdout.close()
+            call.stderr.close()
+
+        wall_time = time.time() - start
+        self._record(name, wall_time, False)
+        self.log.debug("'%s' completed in %.3f secs (return code %d)." % \
+            (name, wall_time, call.returncode))
+
+        return ''.join(output[out_fd]), ''.join(output[err_fd]), \
+                call.returncode, wall_time
@@ -3,16 +3,35 @@
 
 import signal
 import os
+import logging
+import re
 import subprocess
-import time
-from datetime import datetime 
+from datetime import datetime, timedelta
+from threading import Lock
 
 from  sft.errors.cron import CronError, CronRangeError, CronSyntaxError
+from sft.utils.cron import CronSchedule
+from sft.utils.executor import Alarm, Executor
+import sft.sft_globals as g
 
-from sqlalchemy import and_, desc
+from sqlalchemy import and_, desc, func, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import subqueryload_all
 import sft.db.sft_meta as meta
 import sft.db.sft_schema as schema
 
+log = logging.getLogger(__name__)
+
+# secs the job transitions get re-scanned by get_job_transitions, as 
+# they become visible at commit (not in the order of their sequence number)
+TRANSITION_WINDOW = 600
+
+# arc job lists of submitted jobs, one per cluster and submitting thread 
+# (see get_joblist), and the locks guarding them
+JOBLIST_DIR = 'joblists'
+_joblist_locks = {}  # path of job list -> Lock
+_joblist_locks_lock = Lock()
+
 
 def get_sft_test_details(sft_name):
     """ returns the  SFT test description 
@@ -27,6 +46,41 @@ def get_sft_tests_details():
     """
     return meta.Session.query(schema.SFTTest)
 
+def get_sft_tests_snapshot():
+    """ returns a list with all SFT test description objects, with 
+        their VO group (including the users of the VOs), cluster group 
+        and test suit eagerly loaded. Only a few queries are issued,
+        no matter how many SFTs there are.
+    """
+    return meta.Session.query(schema.SFTTest).options(
+            subqueryload_all('vo_group_details.vos.users'),
+            subqueryload_all('cluster_group_details.clusters'),
+            subqueryload_all('test_suit_details.tests')).all()
+
+def get_config_version(session = None):
+    """ returns current version (integer) of the SFT configuration, 
+        i.e. of SFTs, their groups and group members. 0 if it has never 
+        been set.
+    """
+    if not session:
+        session = meta.Session
+    version = session.query(schema.ConfigVersion.version).\
+                filter_by(id = 1).scalar()
+    return version or 0
+
+def bump_config_version(session):
+    """ increments version of SFT configuration. Must be called 
+        (before commit) by everyone who changes the SFT configuration, 
+        so that the SFT daemon picks up the changes. 
+        session - session of the change (not committed here) 
+    """
+    t_version = schema.t_config_version
+    result = session.execute(t_version.update().\
+                where(t_version.c.id == 1).\
+                values(version = t_version.c.version + 1))
+    if result.rowcount == 0:
+        session.execute(t_version.insert().values(id = 1, version = 1))
+
 def get_all_sft_names():
     """ returns list with names of all existing SFTs. """
     sft_names = []
@@ -53,14 +107,16 @@ def get_all_sft_jobs(sft_name, cluster_name = None):
 def get_cluster_last_sfts(cluster_name):
     """ returns a dictionary  of the latest SFT job results  (each SFT
         once), or None if there weren't any SFT jobs for the specified cluster.
+        The results (LatestResult objects) are read from the 
+        sft_latest_result table. 
     """
 
     sfts = {}
-    _skipp = [] # keeps track of sft_test_name and test_name that are already in
+    _skipp = set() # keeps track of sft_test_name and test_name that are already in
  
-    for job in meta.Session.query(schema.SFTJob).\
+    for job in meta.Session.query(schema.LatestResult).\
     filter_by(cluster_name = cluster_name).\
-    order_by(desc(schema.SFTJob.submissiontime)):
+    order_by(desc(schema.LatestResult.submissiontime)):
         if (job.sft_test_name, job.test_name)  in _skipp:
             pass 
         else:
@@ -68,10 +124,161 @@ def get_cluster_last_sfts(cluster_name):
                 sfts[job.sft_test_name] = []
 
             sfts[job.sft_test_name].append(job)
-            _skipp.append((job.sft_test_name, job.test_name))
+            _skipp.add((job.sft_test_name, job.test_name))
 
     return sfts
 
+def _latest_result_upsert():
+    """ returns statement that inserts a row into sft_latest_result, 
+        or updates the existing row of the same (sft, cluster, VO, test), 
+        unless that one is of a more recently submitted job (MySQL). 
+        Notice, MySQL assigns the columns from left to right, hence 
+        submissiontime must be assigned last. 
+    """
+    columns = [c for c in schema.LATEST_RESULT_COLUMNS if c != 'submissiontime'] + \
+            ['submissiontime']
+    keys = [c.name for c in schema.t_latest_result.primary_key.columns]
+    updates = ["%s = IF(VALUES(submissiontime) >= submissiontime, VALUES(%s), %s)" % \
+            (c, c, c) for c in columns if c not in keys]
+    return text("INSERT INTO %s (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s" % \
+            (schema.t_latest_result.name, ', '.join(columns), 
+            ', '.join([':' + c for c in columns]), ', '.join(updates)))
+
+def _update_latest_result(session, values):
+    """ updates the latest result with the values (dictionary with 
+        sft_latest_result columns) of one job, with plain UPDATE/INSERT 
+        statements (any db backend). 
+    """
+    t_latest = schema.t_latest_result
+    key = and_(t_latest.c.sft_test_name == values['sft_test_name'],
+            t_latest.c.cluster_name == values['cluster_name'],
+            t_latest.c.vo_name == values['vo_name'],
+            t_latest.c.test_name == values['test_name'])
+    update = t_latest.update().\
+            where(and_(key, t_latest.c.submissiontime <= values['submissiontime'])).\
+            values(**values)
+
+    if session.execute(update).rowcount:
+        return
+    if session.execute(select([func.count()]).select_from(t_latest).where(key)).scalar():
+        return # result of a more recent job
+    savepoint = session.begin_nested()
+    try:
+        session.execute(t_latest.insert().values(**values))
+        savepoint.commit()
+    except IntegrityError:
+        savepoint.rollback() # inserted by someone else meanwhile
+        session.execute(update)
+
+def update_latest_results(session, jobs):
+    """ updates the latest results (sft_latest_result) with the given 
+        jobs, unless there is a result of a more recently submitted job. 
+        With MySQL all jobs are written with one (batched) upsert 
+        statement, with other db backends job by job. 
+        The updates are done within a savepoint, so if they fail the 
+        job changes of the session are kept (the error gets logged). 
+
+        session - session of the job changes (not committed here)
+        jobs - list of SFTJob objects or of dictionaries with sft_job columns
+    """
+    if not jobs:
+        return
+    rows = []
+    for job in jobs:
+        if isinstance(job, dict):
+            rows.append(dict([(c, job.get(c)) for c in schema.LATEST_RESULT_COLUMNS]))
+        else:
+            rows.append(dict([(c, getattr(job, c)) for c in schema.LATEST_RESULT_COLUMNS]))
+
+    savepoint = session.begin_nested()
+    try:
+        if session.get_bind(None).dialect.name == 'mysql':
+            session.execute(_latest_result_upsert(), rows)
+        else:
+            for values in rows:
+                _update_latest_result(session, values)
+        savepoint.commit()
+    except Exception, e:
+        savepoint.rollback()
+        log.error("Updating latest results of %d jobs failed with %r" % (len(rows), e))
+
+def log_job_transitions(session, jobs, status = None, now = None):
+    """ appends the state transitions of the given jobs to the 
+        transition log (sft_job_transition). 
+        session - session of the job changes (not committed here)
+        jobs - list of SFTJob objects or of dictionaries with sft_job columns
+        status - status of the transitions, defaults to the status of the jobs 
+        now - time of the transitions (UTC), defaults to current time 
+    """
+    if not jobs:
+        return
+    if not now:
+        now = datetime.utcnow()
+    columns = ['jobid', 'sft_test_name', 'cluster_name', 'vo_name', 'test_name', 'status']
+    rows = []
+    for job in jobs:
+        if not isinstance(job, dict):
+            job = dict([(c, getattr(job, c)) for c in columns + ['id']])
+        row = dict([(c, job.get(c)) for c in columns])
+        row['job_id'] = job.get('id')
+        row['time'] = now
+        if status:
+            row['status'] = status
+        rows.append(row)
+    session.execute(schema.t_job_transition.insert(), rows)
+
+def get_job_transitions(since = 0, limit = 1000, window = TRANSITION_WINDOW):
+    """ returns (up to limit) state transitions of SFT jobs with a
+        sequence number larger than since, ordered by sequence number.
+        Consumers remember the largest sequence number ('seq') they got, 
+        and pass it as 'since' on their next call. 
+
+        Notice, sequence numbers are assigned at insert, but become 
+        visible at commit, i.e. not necessarily in order, as transitions
+        are written concurrently (submissions, publisher, housekeeper). 
+        Hence the transitions of the last 'window' secs with a sequence
+        number up to since are returned again (on top of limit), and 
+        consumers must skip the ones (seq) they already got. 
+
+        returns list of JobTransition objects 
+    """
+    transitions = meta.Session.query(schema.JobTransition).\
+        filter(schema.JobTransition.seq > since).\
+        order_by(schema.JobTransition.seq).limit(limit).all()
+    if since and window:
+        transitions += meta.Session.query(schema.JobTransition).\
+            filter(and_(schema.JobTransition.seq <= since,
+                schema.JobTransition.time >= datetime.utcnow() - timedelta(seconds = window))).\
+            all()
+        transitions.sort(key = lambda t: t.seq)
+    return transitions
+
+def get_sft_schedule(sft_name):
+    """ returns compiled (CronSchedule) execution times of  
+        SFT with given name, or None if SFT does not exist. 
+
+        raises CronError if the execution times are invalid.
+    """
+    sft = get_sft_test_details(sft_name)
+    if not sft:
+        return None
+    return CronSchedule(sft.minute, sft.hour, sft.day, 
+            sft.month, sft.day_of_week)
+
+def get_sft_next_runs(sft_name, n = 5, t = None):
+    """ returns list with the next n execution times (UTC) 
+        of SFT with given name (empty list if SFT does not exist). 
+        t - datetime object (UTC), using 'now' if not set
+
+        raises CronError if the execution times are invalid.
+    """
+    schedule = get_sft_schedule(sft_name)
+    if not schedule:
+        return []
+    if not t:
+        t = datetime.utcnow()
+    return schedule.next_times(t, n)
+
 def get_job(name):
     """ returns SFT job with given name in db. """
     return meta.Session.query(schema.SFTTest).\
@@ -121,7 +328,8 @@ def get_test_suit_details(suit_name):
  
 def parse_cron_entry(cron_str, _max):
     """
-    Parser for *simple* crontab style entries. 
+    Parser for *simple* crontab style entries. See
+    sft.utils.cron.CronSchedule for the full crontab syntax.
     input: cron_str - crontab like entry as string
              covered cases:
              - integer up to max
@@ -156,7 +364,7 @@ def parse_cron_entry(cron_str, _max):
             step = int(cron_str.split('/')[1])
         except:
             raise CronSyntaxError("Syntax Error",
-                "'%s' in '%s' must be an integer." % (cron_str.spli('/')[1], cron_str))
+                "'%s' in '%s' must be an integer." % (cron_str.split('/')[1], cron_str))
         
         if pre == '*':
             return range(0, _max + 1, step)
@@ -187,7 +395,7 @@ def parse_cron_entry(cron_str, _max):
         for i in cron_str.split(','):
             if i.isdigit():
                 v = int(i)
-                if v > max:
+                if v > _max:
                     res.append(_max)
                 else: 
                     res.append(v)
@@ -238,9 +446,6 @@ def strip_args(func):
     return new_func
 
 
-class Alarm(Exception):
-    pass
-
 def timeout_call_old(cmd, timeout):
     """ Invokes command specified by @cmd. 
         Raises 'Alarm' Exception if cmd does
@@ -270,30 +475,56 @@ def timeout_call_old(cmd, timeout):
     return res, return_code
 
 
-def timeout_call(cmd, timeout):
+def get_joblist(cluster_name, worker):
+    """ returns path of the arc job list the jobs submitted to cluster 
+        by worker (thread name) get stored in. As every worker has its 
+        own job lists, submissions of different workers don't interfere. 
+        The job list directory gets created if it does not exist. 
     """
-    taken from http://amix.dk/blog/post/19408
-    call shell-command and either return its output or kill it
-    if it doesn't normally exit within timeout seconds and return None"""
+    directory = os.path.join(g.config.jobsdir, JOBLIST_DIR)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory): # not created by someone else
+                raise
+    name = re.sub(r'[^A-Za-z0-9.-]', '_', '%s-%s' % (cluster_name, worker))
+    return os.path.join(directory, name + '.xml')
+
+def get_joblist_lock(path):
+    """ returns lock (threading.Lock) that guards the arc job list at 
+        path. Must be held by arc commands that use the job list. 
+    """
+    _joblist_locks_lock.acquire()
+    try:
+        if not _joblist_locks.has_key(path):
+            _joblist_locks[path] = Lock()
+        return _joblist_locks[path]
+    finally:
+        _joblist_locks_lock.release()
 
-    start = datetime.now()
-    call = subprocess.Popen(cmd,
-            shell = True, close_fds = True,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.PIPE)
 
-    while call.poll() is None:
-        time.sleep(1)
-        now = datetime.now()
-        if (now - start).seconds > timeout:
-            os.kill(call.pid, signal.SIGKILL)
-            os.waitpid(-1, os.WNOHANG)
-            raise Alarm
+def get_executor():
+    """ returns the (process wide) executor of arc commands. 
+        Creates it, if it has not been initialized yet.
+    """
+    if not g.executor:
+        g.executor = Executor()
+    return g.executor
 
-    out, err  = call.communicate()
-    return_code = call.returncode
+
+def timeout_call(cmd, timeout, env = None, x509_user_proxy = None):
+    """
+    call shell-command and either return its output or kill it
+    if it doesn't normally exit within timeout seconds (raises Alarm).
     
-    return out, err, return_code
+    env, x509_user_proxy - environment and proxy credential of the 
+                command (see get_call_env)
+    returns tupple (stdout, stderr, return code)
+    """
+    output, stderr, return_code, _ = get_executor().execute(cmd, timeout,
+            env, x509_user_proxy)
+    return output, stderr, return_code
 
 
 
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Append-only on-disk spool of text lines (e.g. check results for Nagios).
+
+Lines are appended to numbered segment files, one fsync per appended
+batch. A consumer reads the lines in the order they got appended
+(peek), and confirms them once they've been processed (commit). The
+position of the consumer is stored in a cursor file, hence lines that
+have been confirmed are not replayed after a restart.
+
+Both memory and disk usage are bounded: lines are read in batches, and
+if there are more than 'max_segments' segments, the oldest segment gets
+evicted (its lines are lost).
+"""
+__author__ = "Placi Flury grid@switch.ch"
+__date__ = "18.10.2026"
+__version__ = "0.1.0"
+
+import os
+import os.path
+import logging
+from threading import Lock
+
+
+class Spool(object):
+    """ Append-only spool of lines in a directory. Can be shared
+        by one producer and one consumer thread.
+    """
+
+    SEGMENT_LINES = 1000    # max number of lines per segment
+    PREFIX = 'segment-'
+    CURSOR = 'cursor'
+
+    def __init__(self, directory, max_segments = 50):
+        """ directory - spool directory (gets created if it does not exist)
+            max_segments - max number of segments kept on disk
+        """
+        self.log = logging.getLogger(__name__)
+        self.directory = directory
+        self.max_segments = max(max_segments, 2)
+        self.lock = Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.segments = sorted([int(name[len(Spool.PREFIX):])
+                for name in os.listdir(directory)
+                if name.startswith(Spool.PREFIX) and name[len(Spool.PREFIX):].isdigit()])
+
+        # position of consumer (segment number, byte offset)
+        self.read_seg, self.read_offset = self.__load_cursor()
+        if self.read_seg not in self.segments:
+            if self.segments:
+                self.read_seg, self.read_offset = self.segments[0], 0
+            else:
+                self.read_seg, self.read_offset = 1, 0
+
+        # always start a new segment for writing
+        if self.segments:
+            self.write_seg = self.segments[-1] + 1
+        else:
+            self.write_seg = self.read_seg
+        self.write_file = None
+        self.write_lines = 0
+
+        if self.segments:
+            self.log.info("Found %d spooled segments to replay in '%s'." % \
+                (len(self.segments), directory))
+
+    def __path(self, seg):
+        return os.path.join(self.directory, '%s%010d' % (Spool.PREFIX, seg))
+
+    def __load_cursor(self):
+        """ returns stored (segment, offset) of consumer """
+        try:
+            seg, offset = open(os.path.join(self.directory, Spool.CURSOR)).read().split()
+            return int(seg), int(offset)
+        except (IOError, ValueError):
+            return None, 0
+
+    def __save_cursor(self):
+        path = os.path.join(self.directory, Spool.CURSOR)
+        tmp = path + '.tmp'
+        _file = open(tmp, 'w')
+        try:
+            _file.write('%d %d\n' % (self.read_seg, self.read_offset))
+        finally:
+            _file.close()
+        os.rename(tmp, path)
+
+    def __remove_segment(self, seg):
+        """ removes segment seg (must be called with lock held) """
+        try:
+            os.remove(self.__path(seg))
+        except OSError:
+            pass
+        self.segments.remove(seg)
+        if seg == self.read_seg:
+            if self.segments:
+                self.read_seg = self.segments[0]
+            else:
+                self.read_seg = self.write_seg
+            self.read_offset = 0
+
+    def append(self, lines):
+        """ appends lines (without newlines) to spool, and syncs
+            them to disk.
+        """
+        self.lock.acquire()
+        try:
+            while lines:
+                if not self.write_file:
+                    self.write_file = open(self.__path(self.write_seg), 'a')
+                    self.write_lines = 0
+                    if self.write_seg not in self.segments:
+                        self.segments.append(self.write_seg)
+                n = Spool.SEGMENT_LINES - self.write_lines
+                chunk, lines = lines[:n], lines[n:]
+                self.write_file.write(''.join([line + '\n' for line in chunk]))
+                self.write_file.flush()
+                os.fsync(self.write_file.fileno())
+                self.write_lines += len(chunk)
+
+                if self.write_lines >= Spool.SEGMENT_LINES:
+                    self.write_file.close()
+                    self.write_file = None
+                    self.write_seg += 1
+
+            while len(self.segments) > self.max_segments:
+                seg = self.segments[0]
+                self.log.warn("Spool '%s' is full, dropping segment %d." % \
+                    (self.directory, seg))
+                self.__remove_segment(seg)
+        finally:
+            self.lock.release()
+
+    def peek(self, n):
+        """ returns tupple (lines, position) of up to n of the oldest
+            lines that have not been committed yet. Pass position to
+            commit() once the lines have been processed.
+            Returns ([], None) if spool is empty.
+        """
+        self.lock.acquire()
+        try:
+            while self.read_seg in self.segments:
+                lines = []
+                _file = open(self.__path(self.read_seg), 'r')
+                try:
+                    _file.seek(self.read_offset)
+                    offset = self.read_offset
+                    while len(lines) < n:
+                        line = _file.readline()
+                        if not line.endswith('\n'):
+                            break  # end of segment
+                        lines.append(line[:-1])
+                        offset += len(line)
+                finally:
+                    _file.close()
+                if lines:
+                    return lines, (self.read_seg, offset)
+
+                if self.read_seg == self.write_seg:
+                    break # segment is still being written
+                # segment has been consumed entirely
+                self.__remove_segment(self.read_seg)
+                self.__save_cursor()
+            return [], None
+        finally:
+            self.lock.release()
+
+    def commit(self, position):
+        """ confirms that the lines returned by peek() with
+            position have been processed.
+        """
+        self.lock.acquire()
+        try:
+            seg, offset = position
+            if seg != self.read_seg:
+                return # segment got evicted meanwhile
+            self.read_offset = offset
+            self.__save_cursor()
+        finally:
+            self.lock.release()
@@ -13,10 +13,8 @@ import sys
 from optparse import OptionParser
 from sqlalchemy import engine_from_config
 
-from gridmonitor.model.nagios import init_model as init_nagios_model
-
 import sft.sft_globals as g
-from sft import init_configuration, init_nagios_notifier, init_proxy_util
+from sft import init_configuration, init_nagios_notifier, init_proxy_util, init_executor
 from sft.daemon import Daemon
 from sft.db import init_model
 from sft.scheduler import Scheduler
@@ -31,6 +29,7 @@ class SFTDaemon(Daemon):
         # import only after having initialized config
         init_nagios_notifier(g.config)
         init_proxy_util(g.config)
+        init_executor()
 
         # db connections
         try:
@@ -38,9 +37,11 @@ class SFTDaemon(Daemon):
             init_model(sft_engine)
             self.log.info("SFT DB connection initialized")
 
-            nagios_engine = engine_from_config(g.config.sqlalchemy_nagios, 'sqlalchemy_nagios.')
-            init_nagios_model(nagios_engine)
-            self.log.info('Nagios DB connection initialized')
+            if g.config.downtime_provider == 'ndoutils':
+                from gridmonitor.model.nagios import init_model as init_nagios_model
+                nagios_engine = engine_from_config(g.config.sqlalchemy_nagios, 'sqlalchemy_nagios.')
+                init_nagios_model(nagios_engine)
+                self.log.info('Nagios DB connection initialized')
 
         except Exception, e:
             self.log.error("Session object to database(s) failed: %r", e)